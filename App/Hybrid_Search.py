@@ -1,42 +1,304 @@
-from qdrant_client import QdrantClient, models
+import asyncio
+import math
+import os
+from dataclasses import dataclass
+from typing import Optional
+from qdrant_client import models
+from App import embeddings, metrics, qdrant
+
+
+@dataclass
+class FinancialContext:
+    """
+    Budget constraints from the search form, pushed down into Qdrant.
+
+    A product is shown when it fits the budget, when its 12-month installment
+    fits `monthly_allowance`, or when it is at most 25% over budget. Those rules
+    become a single `should` range filter on the indexed `discounted_price`,
+    so every hit Qdrant returns is usable; `classify` tags which rule matched.
+    """
+    max_budget: Optional[float] = None
+    monthly_allowance: Optional[float] = None
+
+    INSTALLMENT_MONTHS = 12
+    CLOSE_MARGIN = 1.25
+
+    def to_filter(self):
+        if not self.max_budget:
+            return None
+        should = [
+            models.FieldCondition(
+                key="discounted_price",
+                range=models.Range(lte=self.max_budget * self.CLOSE_MARGIN),
+            )
+        ]
+        if self.monthly_allowance:
+            should.append(
+                models.FieldCondition(
+                    key="discounted_price",
+                    range=models.Range(lte=self.monthly_allowance * self.INSTALLMENT_MONTHS),
+                )
+            )
+        return models.Filter(should=should)
+
+    def classify(self, price):
+        """Return (match_type, message) for a price, or None if it is out of budget."""
+        if not self.max_budget:
+            return "match", ""
+        if price <= self.max_budget:
+            return "match", ""
+        monthly = price / self.INSTALLMENT_MONTHS
+        if self.monthly_allowance and monthly <= self.monthly_allowance:
+            return "alternative_installment", f"Fits monthly budget (${monthly:.0f}/mo)"
+        if price <= self.max_budget * self.CLOSE_MARGIN:
+            return "alternative_close", f"Only ${price - self.max_budget:.0f} over budget"
+        return None
+
+
+@dataclass(frozen=True)
+class RetrievalParams:
+    """
+    Tunable knobs of the hybrid query. The defaults are the original query:
+    dense + sparse prefetch of `limit + offset` candidates each, reranked by
+    ColBERT.
+
+    `fusion` set to "rrf" or "dbsf" fuses the prefetches instead of running
+    the ColBERT rerank. `oversampling` multiplies the prefetch depth relative
+    to `limit + offset`, giving the rerank more candidates. `hnsw_ef` is the
+    HNSW beam width of the prefetches; `exact` bypasses HNSW and quantization
+    entirely (ground truth for benchmarks).
+
+    On a quantized `text-dense` (see App/bootstrap.py), the dense prefetch
+    scores `quantization_oversampling` times more candidates with the
+    compressed vectors and, if `rescore` is set, re-scores them with the
+    originals. Both are ignored on a collection without quantization.
+    """
+    prefetch_limit: Optional[int] = None
+    fusion: Optional[str] = None
+    oversampling: float = 1.0
+    hnsw_ef: Optional[int] = None
+    exact: bool = False
+    rescore: bool = True
+    quantization_oversampling: Optional[float] = None
+
+    FUSIONS = {"rrf": models.Fusion.RRF, "dbsf": models.Fusion.DBSF}
+
+    def search_params(self):
+        if self.hnsw_ef is None and not self.exact:
+            return None
+        return models.SearchParams(hnsw_ef=self.hnsw_ef, exact=self.exact)
+
+    def dense_search_params(self):
+        """search_params plus the quantization settings (only `text-dense` is quantized)."""
+        if self.exact:
+            quantization = models.QuantizationSearchParams(ignore=True)
+        elif self.quantization_oversampling is not None or not self.rescore:
+            quantization = models.QuantizationSearchParams(
+                rescore=self.rescore,
+                oversampling=self.quantization_oversampling,
+            )
+        else:
+            return self.search_params()
+        return models.SearchParams(hnsw_ef=self.hnsw_ef, exact=self.exact, quantization=quantization)
+
+
+DEFAULT_RETRIEVAL = RetrievalParams()
+
+# Named retrieval profiles, cheapest first. Endpoints pick one per call.
+RETRIEVAL_PROFILES = {
+    # Feed tiles / recommendations: dense + sparse fused with RRF, no ColBERT
+    # (on a quantized collection, compressed scores are used as-is)
+    "fast": RetrievalParams(fusion="rrf", rescore=False),
+    # ColBERT rerank over an oversampled dense + sparse candidate set
+    "balanced": RetrievalParams(
+        oversampling=float(os.getenv("RETRIEVAL_OVERSAMPLING", "2")),
+        quantization_oversampling=float(os.getenv("RETRIEVAL_QUANTIZATION_OVERSAMPLING", "2")),
+    ),
+    # AI explanation path: deeper prefetch and a wider HNSW beam
+    "deep": RetrievalParams(
+        oversampling=float(os.getenv("RETRIEVAL_DEEP_OVERSAMPLING", "4")),
+        hnsw_ef=int(os.getenv("RETRIEVAL_DEEP_HNSW_EF", "256")),
+        quantization_oversampling=float(os.getenv("RETRIEVAL_DEEP_QUANTIZATION_OVERSAMPLING", "3")),
+    ),
+}
+
+
+def retrieval_profile(name: Optional[str], default: str = "balanced") -> RetrievalParams:
+    """RetrievalParams for a profile name; None selects `default`."""
+    name = name or default
+    if name not in RETRIEVAL_PROFILES:
+        raise ValueError(f"Unknown retrieval profile '{name}'. Choose one of: {', '.join(RETRIEVAL_PROFILES)}")
+    return RETRIEVAL_PROFILES[name]
 
 
 class HybridSearcher:
-    DENSE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
-    SPARSE_MODEL = "Qdrant/bm25"
-    LATE_INTERACTION_MODEL = "colbert-ir/colbertv2.0"
+    DENSE_MODEL = embeddings.DENSE_MODEL
+    SPARSE_MODEL = embeddings.SPARSE_MODEL
+    LATE_INTERACTION_MODEL = embeddings.LATE_INTERACTION_MODEL
+    QUERY_MODELS = (DENSE_MODEL, SPARSE_MODEL, LATE_INTERACTION_MODEL)
 
-    def __init__(self, collection_name):
-        import os
+    def __init__(self, collection_name, embedding_cache=None, qdrant_client=None):
         self.collection_name = collection_name
-        self.qdrant_client = QdrantClient(
-            url=os.getenv("QDRANT_URL", "http://localhost:6333"),
-            api_key=os.getenv("QDRANT_API_KEY")
-        )
+        self.qdrant_client = qdrant_client or qdrant.get_client()
+        self.embedding_cache = embedding_cache or embeddings.query_embedding_cache
 
+    @staticmethod
+    def _merge_filters(filters=None, financial_context=None):
+        budget_filter = financial_context.to_filter() if financial_context else None
+        if filters is None or budget_filter is None:
+            return filters or budget_filter
+        return models.Filter(must=[filters, budget_filter])
 
-    def search(self, text: str, filters=None, limit: int = 5, offset: int = 0):
-        search_result = self.qdrant_client.query_points(
+    def _embed_query(self, text: str) -> dict:
+        """Query vectors for all three models, served from the embedding cache."""
+        return self.embedding_cache.embed_many(text, self.QUERY_MODELS)
+
+    def _query_kwargs(self, vectors: dict, filters=None, limit: int = 5, offset: int = 0,
+                      params: RetrievalParams = DEFAULT_RETRIEVAL):
+        """Build the dense + sparse prefetch / ColBERT rerank (or fusion) query from raw vectors."""
+        # Fetch more to support offset (and oversample for the rerank)
+        prefetch_limit = max(params.prefetch_limit or 0, math.ceil((limit + offset) * params.oversampling))
+        kwargs = dict(
             collection_name=self.collection_name,
             prefetch=[
                 models.Prefetch(
-                    query=models.Document(text=text, model=self.DENSE_MODEL),
+                    query=vectors[self.DENSE_MODEL],
                     using="text-dense",
-                    limit=limit + offset # Fetch more to support offset
+                    limit=prefetch_limit,
+                    params=params.dense_search_params(),
                 ),
                 models.Prefetch(
-                    query=models.Document(text=text, model=self.SPARSE_MODEL),
+                    query=vectors[self.SPARSE_MODEL],
                     using="text-sparse",
-                    limit=limit + offset
+                    limit=prefetch_limit,
+                    params=params.search_params(),
                 ),
             ],
-            query=models.Document(text=text, model=self.LATE_INTERACTION_MODEL),
-            using="text-late-interaction",
             with_payload=True,
             query_filter=filters,
             limit=limit,
             offset=offset,
+        )
+        if params.fusion:
+            kwargs["query"] = models.FusionQuery(fusion=params.FUSIONS[params.fusion])
+        else:
+            kwargs["query"] = vectors[self.LATE_INTERACTION_MODEL]
+            kwargs["using"] = "text-late-interaction"
+        return kwargs
+
+    def _query_request(self, vectors: dict, filters=None, limit: int = 5, offset: int = 0,
+                       params: RetrievalParams = DEFAULT_RETRIEVAL):
+        """Same query as _query_kwargs, as one entry of a query_batch_points call."""
+        kwargs = self._query_kwargs(vectors, filters, limit, offset, params)
+        del kwargs["collection_name"]
+        kwargs["filter"] = kwargs.pop("query_filter")
+        return models.QueryRequest(**kwargs)
+
+    @staticmethod
+    def _span_attrs(prefetch, limit: int, params: RetrievalParams) -> dict:
+        """Prefetch sizes and rerank of a query, for the request timing waterfall."""
+        return {
+            "limit": limit,
+            "prefetch": [p.limit for p in prefetch or []],
+            "rerank": params.fusion or "colbert",
+        }
+
+    def _vector_query_kwargs(self, vector, filters=None, limit: int = 5):
+        """Dense-only query with a precomputed MiniLM vector (no embedding at query time)."""
+        return dict(
+            collection_name=self.collection_name,
+            query=vector,
+            using="text-dense",
+            with_payload=True,
+            query_filter=filters,
+            limit=limit,
+        )
+
+    def search_by_vector(self, vector, filters=None, limit: int = 5):
+        search_result = self.qdrant_client.query_points(
+            **self._vector_query_kwargs(vector, filters, limit)
+        ).points
+        return [point.payload for point in search_result]
+
+    def search_batch_points(self, texts: list, filters=None, limit: int = 5,
+                            params: RetrievalParams = DEFAULT_RETRIEVAL) -> list:
+        """
+        Run the hybrid query for several texts in one Qdrant round trip.
+
+        Returns one list of points (with ids) per text, in input order.
+        """
+        requests = [self._query_request(self._embed_query(text), filters, limit, params=params) for text in texts]
+        responses = self.qdrant_client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests,
+        )
+        return [response.points for response in responses]
+
+    def search(self, text: str, filters=None, limit: int = 5, offset: int = 0, financial_context=None,
+               params: RetrievalParams = DEFAULT_RETRIEVAL):
+        vectors = self._embed_query(text)
+        filters = self._merge_filters(filters, financial_context)
+        search_result = self.qdrant_client.query_points(
+            **self._query_kwargs(vectors, filters, limit, offset, params)
         ).points
         metadata = [point.payload for point in search_result]
         return metadata
 
+
+class AsyncHybridSearcher(HybridSearcher):
+    """
+    Same hybrid query as HybridSearcher, issued through AsyncQdrantClient so
+    the FastAPI event loop is free while Qdrant is working.
+    """
+
+    def __init__(self, collection_name, embedding_cache=None, qdrant_client=None):
+        super().__init__(collection_name, embedding_cache, qdrant_client or qdrant.get_async_client())
+
+    async def _embed_query(self, text: str) -> dict:
+        # Cache hits stay on the loop; inference goes to a worker thread
+        vectors = self.embedding_cache.lookup(text, self.QUERY_MODELS)
+        if vectors is None:
+            with metrics.stage("embed", texts=1):
+                vectors = await asyncio.to_thread(super()._embed_query, text)
+        return vectors
+
+    async def _embed_queries(self, texts: list) -> list:
+        """Vectors for several texts; all cache misses are embedded in one worker call."""
+        vectors = [self.embedding_cache.lookup(text, self.QUERY_MODELS) for text in texts]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            embed = super()._embed_query
+            with metrics.stage("embed", texts=len(missing)):
+                computed = await asyncio.to_thread(lambda: [embed(texts[i]) for i in missing])
+            for i, v in zip(missing, computed):
+                vectors[i] = v
+        return vectors
+
+    async def search_batch_points(self, texts: list, filters=None, limit: int = 5,
+                                  params: RetrievalParams = DEFAULT_RETRIEVAL) -> list:
+        vectors = await self._embed_queries(texts)
+        requests = [self._query_request(v, filters, limit, params=params) for v in vectors]
+        attrs = self._span_attrs(requests[0].prefetch if requests else None, limit, params)
+        with metrics.stage("qdrant_query_batch_points", queries=len(requests), **attrs):
+            responses = await self.qdrant_client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=requests,
+            )
+        return [response.points for response in responses]
+
+    async def search(self, text: str, filters=None, limit: int = 5, offset: int = 0, financial_context=None,
+                     params: RetrievalParams = DEFAULT_RETRIEVAL):
+        vectors = await self._embed_query(text)
+        filters = self._merge_filters(filters, financial_context)
+        kwargs = self._query_kwargs(vectors, filters, limit, offset, params)
+        with metrics.stage("qdrant_query_points", offset=offset, **self._span_attrs(kwargs["prefetch"], limit, params)):
+            search_result = (await self.qdrant_client.query_points(**kwargs)).points
+        metadata = [point.payload for point in search_result]
+        return metadata
+
+    async def search_by_vector(self, vector, filters=None, limit: int = 5):
+        with metrics.stage("qdrant_query_points", limit=limit, using="text-dense"):
+            search_result = (await self.qdrant_client.query_points(
+                **self._vector_query_kwargs(vector, filters, limit)
+            )).points
+        return [point.payload for point in search_result]
@@ -1,31 +1,86 @@
 from langchain_core.output_parsers import JsonOutputParser
-from App.llms import model, ollama_model, vision_model
+from App import llms, metrics
 from App.prompts import query_refinement, image_query_extraction, products_choice
 from langchain_core.prompts import ChatPromptTemplate
+import asyncio
 import base64
+from dataclasses import dataclass, field
+from functools import cached_property
 from langchain_core.messages import HumanMessage
-from qdrant_client import QdrantClient,models
-from App.Hybrid_Search import HybridSearcher
+from qdrant_client import models
+from App.Hybrid_Search import AsyncHybridSearcher, HybridSearcher, retrieval_profile
+from App.semantic_cache import SemanticCache, choice_key, numeric_key
+from App.query_parser import QueryParser
+from App import images
+import logging
 import os
 
-client = QdrantClient(
-    url=os.getenv("QDRANT_URL", "http://localhost:6333"),
-    api_key=os.getenv("QDRANT_API_KEY")
-)
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PipelineResult:
+    """
+    Everything one pipeline run produced, scoped to a single request.
+
+    `products` are the payloads the LLM chose from, so callers can build
+    product cards without running the hybrid search a second time.
+    """
+    query: str
+    answer: str
+    products: list = field(default_factory=list)
+    refined_query: dict = field(default_factory=dict)
+
 
 class Pipeline :
+    searcher_class = HybridSearcher
+    RESULT_LIMIT = 5
+
     def __init__(self):
-        self.hybrid_searcher = HybridSearcher(collection_name="products")
+        self.hybrid_searcher = self.searcher_class(collection_name="products")
+        # Default retrieval profile; callers can pass other RetrievalParams per run
+        self.retrieval = retrieval_profile(os.getenv("PIPELINE_RETRIEVAL_PROFILE", "balanced"))
         self.prompt_refinement = ChatPromptTemplate.from_template(query_refinement)
         self.prompt_choice = ChatPromptTemplate.from_template(products_choice)
-        self.chain_refinement = self.prompt_refinement | model | JsonOutputParser()
-        self.chain_choice = self.prompt_choice | model
+        # Reuse LLM answers for near-identical queries (cosine on the MiniLM query vector)
+        cache_kwargs = dict(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+            max_size=int(os.getenv("SEMANTIC_CACHE_SIZE", "2048")),
+            ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+        )
+        self.refinement_cache = SemanticCache("refine_query", **cache_kwargs)
+        # Simple "<product> under $N" queries are refined locally, without the LLM
+        self.query_parser = QueryParser()
+        self.image_description_cache = images.DescriptionCache(
+            max_size=int(os.getenv("IMAGE_CACHE_SIZE", "512"))
+        )
+        self.choice_cache = SemanticCache("make_choice", **cache_kwargs)
 
-    def describe_image(self, image_path: str):
+    # The LLM client (and its backend import) is built on first use
+    @cached_property
+    def chain_refinement(self):
+        return self.prompt_refinement | llms.get_model() | JsonOutputParser()
+
+    @cached_property
+    def chain_choice(self):
+        return self.prompt_choice | llms.get_model()
+
+    def _query_vector(self, query):
+        searcher = self.hybrid_searcher
+        return searcher.embedding_cache.embed(query, searcher.DENSE_MODEL)
+
+    @staticmethod
+    def _read_image(image_path: str) -> bytes:
         with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode("utf-8")
+            return image_file.read()
 
-        message = HumanMessage(
+    @staticmethod
+    def _encode_image(data: bytes) -> str:
+        """Downscaled JPEG of the upload, base64-encoded for the vision model."""
+        return base64.b64encode(images.prepare_image(data)).decode("utf-8")
+
+    @staticmethod
+    def _image_message(image_data: str) -> HumanMessage:
+        return HumanMessage(
             content=[
                 {"type": "text", "text": image_query_extraction},
                 {
@@ -35,59 +90,274 @@ class Pipeline :
             ]
         )
 
+    @staticmethod
+    def _price_filter(refined_query):
+        try:
+            # Enforce strict budget constraint
+            max_price_limit = refined_query["filters"].get("max_price")
+
+            return models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="discounted_price",
+                        range=models.Range(lte=max_price_limit),
+                    )
+                ],
+            )
+        except Exception as e:
+            return None
+
+    @staticmethod
+    def _max_price(refined_query):
         try:
+            max_price = refined_query["filters"].get("max_price")
+            return float(max_price) if max_price is not None else None
+        except Exception as e:
+            return None
+
+    @staticmethod
+    def _choice_error(query, e):
+        return f"I encountered an error analyzing the products: {str(e)}. However, here are the search results potentially relevant to: {query}"
+
+    def describe_image(self, image_path: str):
+        return self.describe_image_bytes(self._read_image(image_path))
+
+    def describe_image_bytes(self, data: bytes):
+        key = images.content_hash(data)
+        cached = self.image_description_cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            message = self._image_message(self._encode_image(data))
             # Use the vision model for image description
-            print("DEBUG: Invoking vision model...")
-            response = vision_model.invoke([message])
-            print(f"DEBUG: Vision response: {response}")
-            return response.content
+            response = llms.get_vision_model().invoke([message])
         except Exception as e:
-            print(f"DEBUG: Vision Model Error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.warning(f"VISION_ERROR | error={str(e)}", exc_info=True)
             return ""
+        if response.content:
+            self.image_description_cache.put(key, response.content)
+        return response.content
 
-    def search (self, query,filters):
-        return self.hybrid_searcher.search(query, filters)
+    def search (self, query,filters, limit=RESULT_LIMIT, financial_context=None, params=None):
+        return self.hybrid_searcher.search(query, filters, limit=limit, financial_context=financial_context,
+                                           params=params or self.retrieval)
 
     def refine_query(self,query):
+        parsed = self.query_parser.parse(query)
+        if parsed is not None:
+            return parsed
+        vector = self._query_vector(query)
+        query_key = numeric_key(query)
+        cached = self.refinement_cache.lookup(vector, query_key)
+        if cached is not None:
+            return cached
         try:
             answer = self.chain_refinement.invoke({"query": query})
+            self.refinement_cache.store(vector, answer, query_key)
             return answer
         except Exception as e:
             return {"filters": {}, "error": f"Failed to parse: {str(e)}"}
 
-    def make_choice(self,query,product_list):
+    def make_choice(self,query,product_list,financial_context=None):
+        vector = self._query_vector(query)
+        products_key = choice_key(query, product_list, financial_context)
+        cached = self.choice_cache.lookup(vector, products_key)
+        if cached is not None:
+            return cached
         try:
             answer = self.chain_choice.invoke({"query": query, "product_list": product_list})
+            self.choice_cache.store(vector, answer.content, products_key)
             return answer.content
         except Exception as e:
-            return f"I encountered an error analyzing the products: {str(e)}. However, here are the search results potentially relevant to: {query}"
+            return self._choice_error(query, e)
 
-    def pipeline(self,query:str,image_path:str=None):
+    def run(self,query:str,image_path:str=None,financial_context=None,params=None) -> PipelineResult:
         if(image_path):
             try:
                 query += self.describe_image(image_path)
             except Exception as e:
                 query = query
         refined_query = self.refine_query(query)
+        query_filter = self._price_filter(refined_query)
+        preliminary_results = self.search(query,query_filter,financial_context=financial_context,params=params)
+        result = self.make_choice(query,preliminary_results,financial_context)
+        return PipelineResult(query, result, preliminary_results, refined_query)
+
+    def pipeline(self,query:str,image_path:str=None):
+        return self.run(query, image_path).answer
+
+
+class AsyncPipeline(Pipeline):
+    """
+    Async twin of Pipeline for the FastAPI handlers.
+
+    LLM calls go through `ainvoke` and retrieval through AsyncHybridSearcher,
+    so a slow Groq round trip only suspends the request that is waiting on it.
+    """
+
+    searcher_class = AsyncHybridSearcher
+    # How many times RESULT_LIMIT the speculative (unfiltered) search fetches
+    SPECULATIVE_OVERFETCH = 4
+
+    def __init__(self, speculative: bool = False):
+        super().__init__()
+        self.speculative = speculative
+
+    async def describe_image(self, image_path: str):
+        data = await asyncio.to_thread(self._read_image, image_path)
+        return await self.describe_image_bytes(data)
+
+    async def describe_image_bytes(self, data: bytes):
+        key = images.content_hash(data)
+        cached = self.image_description_cache.get(key)
+        if cached is not None:
+            return cached
+
         try:
-            # Enforce strict budget constraint
-            max_price_limit = refined_query["filters"].get("max_price")
-            
-            query_filter = models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="discounted_price",
-                        range=models.Range(lte=max_price_limit),
-                    )
-                ],
-            )
+            # Decoding/resizing is CPU work; keep it off the event loop
+            message = self._image_message(await asyncio.to_thread(self._encode_image, data))
+            with metrics.stage("describe_image", image_bytes=len(data)):
+                response = await llms.get_vision_model().ainvoke([message])
         except Exception as e:
-            query_filter = None
-        preliminary_results = self.search(query,query_filter)
-        result = self.make_choice(query,preliminary_results)
-        return result
+            logger.warning(f"VISION_ERROR | error={str(e)}", exc_info=True)
+            return ""
+        if response.content:
+            self.image_description_cache.put(key, response.content)
+        return response.content
 
+    async def search(self, query, filters, limit=Pipeline.RESULT_LIMIT, financial_context=None, params=None):
+        return await self.hybrid_searcher.search(query, filters, limit=limit, financial_context=financial_context,
+                                                 params=params or self.retrieval)
 
+    async def _query_vector(self, query):
+        searcher = self.hybrid_searcher
+        cached = searcher.embedding_cache.lookup(query, (searcher.DENSE_MODEL,))
+        if cached is not None:
+            return cached[searcher.DENSE_MODEL]
+        with metrics.stage("embed", texts=1):
+            return await asyncio.to_thread(super()._query_vector, query)
 
+    async def refine_query(self, query):
+        # Waterfall span for every path; the refine_query stage is the LLM call alone
+        with metrics.span("refinement") as span:
+            parsed = self.query_parser.parse(query)
+            if parsed is not None:
+                span["source"] = "parser"
+                return parsed
+            vector = await self._query_vector(query)
+            query_key = numeric_key(query)
+            cached = self.refinement_cache.lookup(vector, query_key)
+            if cached is not None:
+                span["source"] = "cache"
+                return cached
+            span["source"] = "llm"
+            try:
+                with metrics.stage("refine_query"):
+                    answer = await self.chain_refinement.ainvoke({"query": query})
+                self.refinement_cache.store(vector, answer, query_key)
+                return answer
+            except Exception as e:
+                return {"filters": {}, "error": f"Failed to parse: {str(e)}"}
+
+    async def make_choice(self, query, product_list, financial_context=None):
+        vector = await self._query_vector(query)
+        products_key = choice_key(query, product_list, financial_context)
+        cached = self.choice_cache.lookup(vector, products_key)
+        if cached is not None:
+            return cached
+        try:
+            with metrics.stage("make_choice", products=len(product_list)):
+                answer = await self.chain_choice.ainvoke({"query": query, "product_list": product_list})
+            self.choice_cache.store(vector, answer.content, products_key)
+            return answer.content
+        except Exception as e:
+            return self._choice_error(query, e)
+
+    async def _refine_and_search(self, query, financial_context=None, params=None):
+        """
+        Refinement followed by the budget-filtered search (strictly serial).
+        """
+        refined_query = await self.refine_query(query)
+        query_filter = self._price_filter(refined_query)
+        return refined_query, await self.search(query, query_filter, financial_context=financial_context, params=params)
+
+    async def _speculative_refine_and_search(self, query, financial_context=None, params=None):
+        """
+        Run refinement and an unfiltered, over-fetched search concurrently.
+
+        Retrieval only needs `max_price` from the refinement, so the budget is
+        applied to the speculative candidates afterwards. Qdrant is queried a
+        second time (with the filter) only when fewer than RESULT_LIMIT
+        candidates fit the budget.
+        """
+        # Both branches need the dense query vector; embed it once up front so
+        # a cold cache does not run MiniLM twice on the same text
+        await self._query_vector(query)
+        refined_query, candidates = await asyncio.gather(
+            self.refine_query(query),
+            self.search(
+                query, None,
+                limit=self.RESULT_LIMIT * self.SPECULATIVE_OVERFETCH,
+                financial_context=financial_context,
+                params=params,
+            ),
+        )
+        max_price = self._max_price(refined_query)
+        if max_price is None:
+            return refined_query, candidates[:self.RESULT_LIMIT]
+
+        survivors = [
+            product for product in candidates
+            if product.get("discounted_price") is not None and product["discounted_price"] <= max_price
+        ]
+        if len(survivors) >= self.RESULT_LIMIT:
+            return refined_query, survivors[:self.RESULT_LIMIT]
+        return refined_query, await self.search(
+            query, self._price_filter(refined_query), financial_context=financial_context, params=params
+        )
+
+    async def _retrieve(self, query, financial_context=None, params=None):
+        if self.speculative:
+            return await self._speculative_refine_and_search(query, financial_context, params)
+        return await self._refine_and_search(query, financial_context, params)
+
+    async def run(self, query: str, image_path: str = None, financial_context=None, params=None) -> PipelineResult:
+        if image_path:
+            try:
+                query += await self.describe_image(image_path)
+            except Exception as e:
+                query = query
+        refined_query, preliminary_results = await self._retrieve(query, financial_context, params)
+        result = await self.make_choice(query, preliminary_results, financial_context)
+        return PipelineResult(query, result, preliminary_results, refined_query)
+
+    async def pipeline(self, query: str, image_path: str = None):
+        return (await self.run(query, image_path)).answer
+
+    async def stream(self, query: str, financial_context=None, params=None):
+        """
+        Yield the retrieved products first, then the explanation as it streams.
+
+        Events are dicts: {"event": "products", "products": [...], "refined_query": {...}}
+        once, followed by any number of {"event": "token", "text": "..."}.
+        """
+        refined_query, preliminary_results = await self._retrieve(query, financial_context, params)
+        yield {"event": "products", "products": preliminary_results, "refined_query": refined_query}
+
+        vector = await self._query_vector(query)
+        products_key = choice_key(query, preliminary_results, financial_context)
+        cached = self.choice_cache.lookup(vector, products_key)
+        if cached is not None:
+            yield {"event": "token", "text": cached}
+            return
+        try:
+            parts = []
+            with metrics.stage("make_choice", products=len(preliminary_results), stream=True):
+                async for chunk in self.chain_choice.astream({"query": query, "product_list": preliminary_results}):
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield {"event": "token", "text": chunk.content}
+            self.choice_cache.store(vector, "".join(parts), products_key)
+        except Exception as e:
+            yield {"event": "token", "text": self._choice_error(query, e)}
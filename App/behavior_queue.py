@@ -0,0 +1,169 @@
+"""
+Write-behind ingestion for user behavior events.
+
+`/api/track` used to embed and upsert every click inline. Events are now put
+on a bounded in-process queue and a background flusher hands them to
+`AsyncUserBehaviorTracker.track_events` in batches, whenever `batch_size`
+events are waiting or `flush_interval` seconds have passed since the first
+one arrived.
+
+When the queue is full, `submit` waits up to `enqueue_timeout` seconds for
+room and then rejects the event, so a slow Qdrant pushes back on clients
+instead of growing memory without bound. A batch that fails to store is
+retried with exponential backoff before it is dropped; dropped and rejected
+events are counted in `behavior_events_dropped_total`. `stop()` drains what
+is queued.
+"""
+
+import asyncio
+from datetime import datetime
+import logging
+import os
+
+from App import metrics
+
+logger = logging.getLogger(__name__)
+
+DROPPED_EVENTS = metrics.REGISTRY.register(metrics.Counter(
+    "behavior_events_dropped_total", "Behavior events that were never stored.", ("reason",)
+))
+
+
+class BehaviorEventQueue:
+    """
+    Bounded queue + background flusher in front of a behavior tracker.
+    """
+
+    def __init__(
+        self,
+        tracker,
+        max_size: int = 10000,
+        batch_size: int = 64,
+        flush_interval: float = 0.5,
+        enqueue_timeout: float = 1.0,
+        flush_retries: int = 3,
+        retry_backoff: float = 0.5
+    ):
+        self.tracker = tracker
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.flush_retries = flush_retries
+        self.retry_backoff = retry_backoff
+        self._queue = None
+        self._flusher = None
+        self.flushed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        """Create the queue and start the flusher on the running event loop."""
+        if self._flusher is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the flusher."""
+        if self._flusher is None:
+            return
+        await self._queue.put(None)  # Sentinel: drain and exit
+        await self._flusher
+        self._flusher = None
+
+    async def submit(self, session_id: str, event_type: str, data: dict) -> bool:
+        """
+        Queue one event. Returns False if the queue stayed full (backpressure).
+        """
+        event = (session_id, event_type, data, datetime.now().isoformat())
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(self._queue.put(event), timeout=self.enqueue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            DROPPED_EVENTS.labels("queue_full").inc()
+            logger.warning(f"TRACK_QUEUE_FULL | session={session_id} | type={event_type}")
+            return False
+
+    async def _next_batch(self):
+        """
+        Wait for one event, then collect more until the batch is full or the
+        flush interval runs out. Returns (batch, stopping).
+        """
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            if event is None:
+                return batch, True
+            batch.append(event)
+        return batch, False
+
+    async def _flush(self, batch):
+        if not batch:
+            return
+        for attempt in range(self.flush_retries + 1):
+            try:
+                stored = await self.tracker.track_events(batch)
+            except Exception as e:
+                logger.warning(f"TRACK_FLUSH_ERROR | count={len(batch)} | error={e}", exc_info=True)
+                stored = False
+            if stored:
+                self.flushed += len(batch)
+                return
+            if attempt < self.flush_retries:
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning(f"TRACK_FLUSH_RETRY | count={len(batch)} | attempt={attempt + 1} | delay={delay}")
+                await asyncio.sleep(delay)
+        self.failed += len(batch)
+        DROPPED_EVENTS.labels("store_failed").inc(len(batch))
+        logger.error(f"TRACK_FLUSH_DROPPED | count={len(batch)} | attempts={self.flush_retries + 1}")
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._next_batch()
+            await self._flush(batch)
+        # Drain anything submitted while the sentinel was in flight
+        leftover = []
+        while not self._queue.empty():
+            event = self._queue.get_nowait()
+            if event is not None:
+                leftover.append(event)
+        for i in range(0, len(leftover), self.batch_size):
+            await self._flush(leftover[i:i + self.batch_size])
+        logger.info(f"TRACK_QUEUE_STOPPED | flushed={self.flushed} | failed={self.failed}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_size": self.max_size,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+def from_env(tracker) -> BehaviorEventQueue:
+    return BehaviorEventQueue(
+        tracker,
+        max_size=int(os.getenv("TRACK_QUEUE_SIZE", "10000")),
+        batch_size=int(os.getenv("TRACK_BATCH_SIZE", "64")),
+        flush_interval=float(os.getenv("TRACK_FLUSH_INTERVAL", "0.5")),
+        flush_retries=int(os.getenv("TRACK_FLUSH_RETRIES", "3")),
+    )
@@ -0,0 +1,263 @@
+"""
+Qdrant collection bootstrap.
+
+One place that knows which collections and payload indexes the app needs.
+`ensure_collection` reads the collection once with `get_collection`, compares
+its `payload_schema` against the spec and creates only the missing indexes
+(concurrently), so a warm start costs one round trip per collection.
+
+`Bootstrapper` runs this in a background task at startup, retrying until
+Qdrant answers, and exposes the outcome for the readiness endpoint.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import logging
+import os
+from typing import Optional
+
+from qdrant_client import models
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CollectionSpec:
+    name: str
+    # field name -> payload schema type
+    indexes: dict
+    # create_collection kwargs; None if the collection is created elsewhere
+    config: Optional[dict] = None
+    # Whether the app can serve without this collection being present
+    required: bool = True
+
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+def products_config(quantization: str = "none", multivector_on_disk: bool = False) -> dict:
+    """
+    create_collection kwargs for the products collection.
+
+    `quantization` ("scalar" = int8, "binary" = 1 bit per dimension) keeps a
+    compressed copy of `text-dense` in RAM and moves the originals to disk,
+    where query-time rescoring reads them. `multivector_on_disk` keeps the
+    ColBERT token vectors (one 128-d vector per token) out of RAM.
+    """
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization '{quantization}'. Choose one of: {', '.join(QUANTIZATION_MODES)}")
+    quantization_config = None
+    if quantization == "scalar":
+        quantization_config = models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True,
+            )
+        )
+    elif quantization == "binary":
+        quantization_config = models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=True)
+        )
+    return dict(
+        vectors_config={
+            "text-dense": models.VectorParams(
+                size=384,  # all-MiniLM-L6-v2 output size
+                distance=models.Distance.COSINE,
+                on_disk=quantization_config is not None,
+                quantization_config=quantization_config,
+            ),
+            "text-late-interaction": models.VectorParams(
+                size=128,  # colbertv2.0 token vector size
+                distance=models.Distance.COSINE,
+                multivector_config=models.MultiVectorConfig(
+                    comparator=models.MultiVectorComparator.MAX_SIM,
+                ),
+                hnsw_config=models.HnswConfigDiff(m=0),  # Disable HNSW for reranking
+                on_disk=multivector_on_disk,
+            ),
+        },
+        sparse_vectors_config={
+            "text-sparse": models.SparseVectorParams(
+                modifier=models.Modifier.IDF,
+                index=models.SparseIndexParams(on_disk=False)
+            )
+        },
+    )
+
+
+# Storage options only apply when the collection is created (bootstrap or ingest_products.py)
+PRODUCTS = CollectionSpec(
+    name="products",
+    indexes={
+        "discounted_price": models.PayloadSchemaType.FLOAT,
+        "actual_price": models.PayloadSchemaType.FLOAT,
+        "rating": models.PayloadSchemaType.FLOAT,
+        "category": models.PayloadSchemaType.KEYWORD,
+    },
+    config=products_config(
+        quantization=os.getenv("PRODUCTS_QUANTIZATION", "none"),
+        multivector_on_disk=os.getenv("PRODUCTS_MULTIVECTOR_ON_DISK", "0") == "1",
+    ),
+)
+
+BEHAVIORS = CollectionSpec(
+    name="user_behaviors",
+    indexes={
+        "session_id": models.PayloadSchemaType.KEYWORD,
+        "event_type": models.PayloadSchemaType.KEYWORD,
+    },
+    config=dict(
+        vectors_config={
+            "behavior": models.VectorParams(
+                size=384,  # all-MiniLM-L6-v2 output size
+                distance=models.Distance.COSINE
+            )
+        }
+    ),
+)
+
+
+async def _get_collection(qdrant_client, name: str):
+    """Collection info, or None if the collection does not exist."""
+    try:
+        return await qdrant_client.get_collection(name)
+    except Exception:
+        # Only a second round trip on the failure path, to tell "missing" from "unreachable"
+        if not await qdrant_client.collection_exists(name):
+            return None
+        raise
+
+
+def _schema_type(index_info):
+    data_type = getattr(index_info, "data_type", None)
+    return getattr(data_type, "value", data_type)
+
+
+async def ensure_collection(qdrant_client, spec: CollectionSpec, create: bool = True) -> dict:
+    """
+    Make sure `spec`'s collection and payload indexes exist.
+
+    The collection is created only if `create` is set and the spec has a
+    config. Returns a status dict: {"exists", "created", "indexes_created"}.
+    """
+    status = {"exists": True, "created": False, "indexes_created": []}
+    info = await _get_collection(qdrant_client, spec.name)
+    if info is None:
+        if not (create and spec.config):
+            status["exists"] = False
+            logger.warning(f"BOOTSTRAP_MISSING | collection={spec.name}")
+            return status
+        await qdrant_client.create_collection(collection_name=spec.name, **spec.config)
+        status["created"] = True
+        logger.info(f"BOOTSTRAP_CREATED | collection={spec.name}")
+        existing = {}
+    else:
+        existing = info.payload_schema or {}
+
+    missing = {}
+    for field_name, schema in spec.indexes.items():
+        if field_name not in existing:
+            missing[field_name] = schema
+        elif _schema_type(existing[field_name]) != schema.value:
+            logger.warning(
+                f"BOOTSTRAP_SCHEMA_MISMATCH | collection={spec.name} | field={field_name} | "
+                f"expected={schema.value} | found={_schema_type(existing[field_name])}"
+            )
+
+    if missing:
+        await asyncio.gather(*(
+            qdrant_client.create_payload_index(
+                collection_name=spec.name,
+                field_name=field_name,
+                field_schema=schema,
+                wait=True,
+            )
+            for field_name, schema in missing.items()
+        ))
+        status["indexes_created"] = sorted(missing)
+        logger.info(f"BOOTSTRAP_INDEXES | collection={spec.name} | created={','.join(sorted(missing))}")
+    return status
+
+
+@dataclass
+class _CollectionState:
+    spec: CollectionSpec
+    create: bool
+    status: Optional[dict] = None
+    error: Optional[str] = None
+
+
+class Bootstrapper:
+    """
+    Ensures collections in the background and reports readiness.
+
+    Pending collections are retried with exponential backoff starting at
+    `retry_interval` seconds (capped at MAX_RETRY_INTERVAL); collections that
+    are already done are not touched again.
+    """
+
+    MAX_RETRY_INTERVAL = 60
+
+    def __init__(self, qdrant_client, collections: list, retry_interval: float = 5):
+        """`collections` is a list of (CollectionSpec, create_if_missing) pairs."""
+        self.qdrant_client = qdrant_client
+        self.retry_interval = retry_interval
+        self.attempts = 0
+        self._states = [_CollectionState(spec, create) for spec, create in collections]
+        self._task = None
+
+    def _done(self, state: _CollectionState) -> bool:
+        return state.status is not None and (state.status["exists"] or not state.spec.required)
+
+    @property
+    def ready(self) -> bool:
+        return all(self._done(state) for state in self._states)
+
+    async def _ensure(self, state: _CollectionState):
+        try:
+            state.status = await ensure_collection(self.qdrant_client, state.spec, state.create)
+            state.error = None
+        except Exception as e:
+            state.error = str(e)
+            logger.error(f"BOOTSTRAP_ERROR | collection={state.spec.name} | error={str(e)}")
+
+    async def run_once(self) -> bool:
+        self.attempts += 1
+        pending = [state for state in self._states if not self._done(state)]
+        await asyncio.gather(*(self._ensure(state) for state in pending))
+        return self.ready
+
+    async def _run(self):
+        delay = self.retry_interval
+        while not await self.run_once():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RETRY_INTERVAL)
+        logger.info(f"BOOTSTRAP_READY | attempts={self.attempts}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "collections": {
+                state.spec.name: {
+                    "ready": self._done(state),
+                    **(state.status or {}),
+                    "error": state.error,
+                }
+                for state in self._states
+            },
+        }
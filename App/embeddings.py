@@ -0,0 +1,243 @@
+"""
+Query Embedding Cache
+
+HybridSearcher used to hand Qdrant `models.Document` objects, so fastembed
+re-embedded the same query text with MiniLM, BM25 and ColBERT on every call.
+This module embeds queries locally, keeps the vectors in a bounded LRU/TTL
+cache keyed by (model, normalized text), and returns them in the raw form
+`query_points` accepts.
+
+The fastembed models are loaded once per process and shared by every cache.
+`ModelWarmup` loads and test-runs them at startup, so the first real query
+does not pay the ONNX load.
+"""
+
+from collections import OrderedDict
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from qdrant_client import models
+
+logger = logging.getLogger(__name__)
+
+
+DENSE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SPARSE_MODEL = "Qdrant/bm25"
+LATE_INTERACTION_MODEL = "colbert-ir/colbertv2.0"
+ALL_MODELS = (DENSE_MODEL, SPARSE_MODEL, LATE_INTERACTION_MODEL)
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(model_name: str):
+    """Load (once) and return the fastembed model for `model_name`."""
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+    with _models_lock:
+        if model_name not in _models:
+            from fastembed import LateInteractionTextEmbedding, SparseTextEmbedding, TextEmbedding
+
+            if model_name == SPARSE_MODEL:
+                _models[model_name] = SparseTextEmbedding(model_name)
+            elif model_name == LATE_INTERACTION_MODEL:
+                _models[model_name] = LateInteractionTextEmbedding(model_name)
+            else:
+                _models[model_name] = TextEmbedding(model_name)
+            logger.info(f"EMBED_MODEL_LOADED | model={model_name}")
+        return _models[model_name]
+
+
+def warm_up(model_name: str) -> float:
+    """Load `model_name` and run one query through it. Returns the seconds it took."""
+    started = time.perf_counter()
+    list(get_model(model_name).query_embed("warm up"))
+    return time.perf_counter() - started
+
+
+class ModelWarmup:
+    """
+    Loads and test-runs embedding models in worker threads at startup.
+
+    `ready` turns True once every model has answered a query. A model that
+    fails is reported in `status()` and retried with exponential backoff
+    (`retry_interval` doubling up to `max_retry_interval`), so a transient
+    failure such as a download timeout does not leave the app not-ready.
+    """
+
+    def __init__(self, model_names=ALL_MODELS, retry_interval: float = None, max_retry_interval: float = None):
+        self.model_names = tuple(model_names)
+        self.retry_interval = (
+            float(os.getenv("WARMUP_RETRY_INTERVAL", "5")) if retry_interval is None else retry_interval
+        )
+        self.max_retry_interval = (
+            float(os.getenv("WARMUP_MAX_RETRY_INTERVAL", "300")) if max_retry_interval is None else max_retry_interval
+        )
+        self.seconds = {}
+        self.errors = {}
+        self.attempts = {}
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return len(self.seconds) == len(self.model_names)
+
+    async def _warm(self, model_name: str):
+        delay = self.retry_interval
+        while True:
+            self.attempts[model_name] = self.attempts.get(model_name, 0) + 1
+            try:
+                self.seconds[model_name] = round(await asyncio.to_thread(warm_up, model_name), 3)
+                self.errors.pop(model_name, None)
+                logger.info(f"EMBED_MODEL_WARM | model={model_name} | seconds={self.seconds[model_name]}")
+                return
+            except Exception as e:
+                self.errors[model_name] = str(e)
+                logger.error(
+                    f"EMBED_MODEL_WARMUP_ERROR | model={model_name} | attempt={self.attempts[model_name]} "
+                    f"| retry_in={delay} | error={str(e)}"
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_interval)
+
+    async def run(self):
+        await asyncio.gather(*(self._warm(name) for name in self.model_names))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "models": {
+                name: {
+                    "seconds": self.seconds.get(name),
+                    "error": self.errors.get(name),
+                    "attempts": self.attempts.get(name, 0),
+                }
+                for name in self.model_names
+            },
+        }
+
+
+def normalize_query(text: str) -> str:
+    # All three models are uncased, so case and whitespace never change the vector
+    return " ".join(text.lower().split())
+
+
+def _to_query_vector(model_name: str, embedding):
+    """Convert a cached fastembed output into the raw vector Qdrant expects."""
+    if model_name == SPARSE_MODEL:
+        return models.SparseVector(
+            indices=embedding.indices.tolist(),
+            values=embedding.values.tolist(),
+        )
+    return embedding.tolist()
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings with a time-to-live.
+
+    Entries hold the numpy output of fastembed (a ColBERT query is a 32x128
+    matrix) and are converted to lists only when a query is built.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            embedding, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return embedding
+
+    def _put(self, key, embedding):
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def lookup(self, text: str, model_names) -> dict:
+        """
+        Return {model_name: query vector} if every model is cached, else None.
+
+        Never runs inference, so it is safe to call on the event loop.
+        """
+        normalized = normalize_query(text)
+        embeddings = {}
+        for model_name in model_names:
+            embedding = self._get((model_name, normalized))
+            if embedding is None:
+                return None
+            embeddings[model_name] = embedding
+        with self._lock:
+            self.hits += len(embeddings)
+        return {name: _to_query_vector(name, emb) for name, emb in embeddings.items()}
+
+    def embed(self, text: str, model_name: str):
+        """Return the query vector for `text`, running inference on a miss."""
+        normalized = normalize_query(text)
+        key = (model_name, normalized)
+        embedding = self._get(key)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if embedding is None:
+            embedding = next(iter(get_model(model_name).query_embed(normalized)))
+            self._put(key, embedding)
+        return _to_query_vector(model_name, embedding)
+
+    def embed_many(self, text: str, model_names) -> dict:
+        return {model_name: self.embed(text, model_name) for model_name in model_names}
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Shared by every HybridSearcher in the process
+query_embedding_cache = QueryEmbeddingCache(
+    max_size=int(os.getenv("EMBEDDING_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("EMBEDDING_CACHE_TTL", "3600")),
+)
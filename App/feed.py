@@ -0,0 +1,230 @@
+"""
+Feed pagination helpers for /api/products.
+
+Qdrant's `scroll` takes a point id as `offset`, not a row count, so the
+generic feed pages with the `next_offset` each scroll returns. It is handed
+to clients as an opaque `next_page_token`. Clients that jump to page numbers
+are served from remembered page starts, or from an id-only skip scroll when
+the page has not been seen yet.
+
+The collection size is cached and refreshed in the background instead of
+calling `get_collection` on every request.
+
+The mixed personalized feed is built once per session with a deep fetch and
+cached; later pages are slices of the same list (see PersonalizedFeedCache).
+"""
+
+import asyncio
+import base64
+from collections import OrderedDict
+import json
+import logging
+import time
+
+from App import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def encode_page_token(offset, page: int, kind: str = "scroll") -> str:
+    """
+    `kind` records which feed issued the token: "scroll" tokens carry a
+    point id, "mixed" tokens a position in the cached personalized list.
+    """
+    raw = json.dumps({"o": offset, "p": page, "k": kind}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_page_token(token: str):
+    """Return (offset, page, kind) from a token produced by encode_page_token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        return data["o"], int(data["p"]), data.get("k", "scroll")
+    except Exception as e:
+        raise InvalidPageToken(f"Invalid page token: {token}") from e
+
+
+class CollectionCounter:
+    """
+    Cached `points_count` of a collection, refreshed every `refresh_interval`
+    seconds by a background task.
+    """
+
+    def __init__(self, qdrant_client, collection_name: str, refresh_interval: float = 60):
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.refresh_interval = refresh_interval
+        self.count = None
+        self._task = None
+
+    async def refresh(self) -> int:
+        info = await self.qdrant_client.get_collection(self.collection_name)
+        self.count = info.points_count or 0
+        return self.count
+
+    async def get(self) -> int:
+        if self.count is None:
+            return await self.refresh()
+        return self.count
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"COUNT_REFRESH_ERROR | collection={self.collection_name} | error={str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class ScrollPager:
+    """
+    Cursor pagination over a collection with `scroll`.
+
+    Remembers where each (limit, page) starts, so numbered page access costs
+    one scroll once the page has been reached before. An unseen page is
+    reached by walking forward from the nearest remembered page, one
+    id-only scroll of `limit` rows per page, remembering every page passed.
+    The end of the collection is never remembered, so pages that were past
+    the end fill in once more products are ingested.
+    """
+
+    def __init__(self, qdrant_client, collection_name: str, max_remembered: int = 10000):
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.max_remembered = max_remembered
+        self._page_starts = OrderedDict()
+
+    def _remember(self, limit: int, page: int, offset):
+        self._page_starts[(limit, page)] = offset
+        self._page_starts.move_to_end((limit, page))
+        while len(self._page_starts) > self.max_remembered:
+            self._page_starts.popitem(last=False)
+
+    def _nearest(self, page: int, limit: int):
+        """(page, start) of the closest remembered page at or before `page`."""
+        best, offset = 1, None
+        for (known_limit, known_page), start in self._page_starts.items():
+            if known_limit == limit and best < known_page <= page:
+                best, offset = known_page, start
+        return best, offset
+
+    async def _start_of(self, page: int, limit: int):
+        """Point id the page starts at (None for the first page or past the end)."""
+        if page <= 1:
+            return None
+        key = (limit, page)
+        if key in self._page_starts:
+            self._page_starts.move_to_end(key)
+            return self._page_starts[key]
+        # Unseen page: step forward page by page without loading payloads
+        current, offset = self._nearest(page, limit)
+        while current < page:
+            with metrics.stage("qdrant_scroll", limit=limit, with_payload=False):
+                _, offset = await self.qdrant_client.scroll(
+                    collection_name=self.collection_name,
+                    limit=limit,
+                    offset=offset,
+                    with_payload=False,
+                    with_vectors=False,
+                )
+            if offset is None:
+                # Past the end of the collection (not remembered)
+                return None
+            current += 1
+            self._remember(limit, current, offset)
+        return offset
+
+    async def fetch(self, limit: int, page: int = 1, page_token: str = None):
+        """
+        Return (points, page, next_page_token) for a page number or a token.
+        """
+        kind = None
+        if page_token:
+            offset, page, kind = decode_page_token(page_token)
+        if kind != "scroll":
+            # No token, or one issued by the personalized feed: go by page number
+            offset = await self._start_of(page, limit)
+            if page > 1 and offset is None:
+                # Past the end of the collection
+                return [], page, None
+
+        with metrics.stage("qdrant_scroll", limit=limit):
+            points, next_offset = await self.qdrant_client.scroll(
+                collection_name=self.collection_name,
+                limit=limit,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+        if next_offset is None:
+            return points, page, None
+        self._remember(limit, page + 1, next_offset)
+        return points, page, encode_page_token(next_offset, page + 1)
+
+
+class PersonalizedFeedCache:
+    """
+    TTL + LRU cache of each session's mixed personalized candidate list.
+
+    Entries are keyed by session and remember the interest fingerprint they
+    were built for. When the session's top interests change, the entry no
+    longer matches and the list is rebuilt, so pages stay stable while the
+    profile does.
+    """
+
+    def __init__(self, max_sessions: int = 5000, ttl_seconds: float = 600):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(top_interests: list) -> frozenset:
+        # Score drift or reordering among the same interests is not a meaningful change
+        return frozenset(interest for interest, _ in top_interests)
+
+    def get(self, session_id: str, fingerprint):
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry_fingerprint, items, expires_at = entry
+            if entry_fingerprint == fingerprint and expires_at > time.monotonic():
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+                return items
+            del self._entries[session_id]
+        self.misses += 1
+        return None
+
+    def put(self, session_id: str, fingerprint, items: list):
+        self._entries[session_id] = (fingerprint, items, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
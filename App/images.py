@@ -0,0 +1,73 @@
+"""
+In-memory image handling for visual search.
+
+Uploads never touch the disk. Before an image is sent to the vision model it
+is downscaled so its longest side is at most `max_side` pixels and
+re-encoded as JPEG, which keeps the base64 payload small. Descriptions are
+cached by a hash of the uploaded bytes, so a repeated image skips the vision
+call entirely.
+"""
+
+from collections import OrderedDict
+import hashlib
+import io
+import threading
+
+from PIL import Image, ImageOps
+
+MAX_SIDE = 1024
+JPEG_QUALITY = 85
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def prepare_image(data: bytes, max_side: int = MAX_SIDE, quality: int = JPEG_QUALITY) -> bytes:
+    """Downscale (keeping aspect ratio) and re-encode image bytes as JPEG."""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+
+
+class DescriptionCache:
+    """LRU map of image content hash -> vision model description."""
+
+    def __init__(self, max_size: int = 512):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            description = self._entries.get(key)
+            if description is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return description
+
+    def put(self, key: str, description: str):
+        with self._lock:
+            self._entries[key] = description
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
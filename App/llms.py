@@ -1,29 +1,68 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain_ollama import ChatOllama
+"""
+LLM clients.
+
+Backends are imported and built on first use, so importing this module does
+not pull in langchain_groq / langchain_ollama / langchain_google_genai.
+`model`, `vision_model`, `ollama_model` and `gemini_model` are still
+available as module attributes and resolve lazily too.
+"""
+
+from functools import lru_cache
 import os
 from dotenv import load_dotenv
 load_dotenv()
-# model = ChatGoogleGenerativeAI(
-#     model = "gemini-2.0-flash",
-#     temperature= 0.7,
-#     api_key= os.getenv("GEMINI_API_KEY")
-# )
+
+
 # Main Text Model (Groq)
-model = ChatGroq(
-    model_name="llama-3.3-70b-versatile",
-    temperature=0.7,
-    api_key=os.getenv("GROQ_API_KEY")
-)
+@lru_cache(maxsize=None)
+def get_model():
+    from langchain_groq import ChatGroq
+    return ChatGroq(
+        model_name="llama-3.3-70b-versatile",
+        temperature=0.7,
+        api_key=os.getenv("GROQ_API_KEY")
+    )
+
 
 # Vision Model (Groq) - Required for Image Search
-vision_model = ChatGroq(
-    model_name="llama-3.2-11b-vision",
-    temperature=0.7,
-    api_key=os.getenv("GROQ_API_KEY")
-)
+@lru_cache(maxsize=None)
+def get_vision_model():
+    from langchain_groq import ChatGroq
+    return ChatGroq(
+        model_name="llama-3.2-11b-vision",
+        temperature=0.7,
+        api_key=os.getenv("GROQ_API_KEY")
+    )
+
 
 # Ollama (Local fallback)
-ollama_model = ChatOllama(
-    model = "llama3.2:latest"
-)
+@lru_cache(maxsize=None)
+def get_ollama_model():
+    from langchain_ollama import ChatOllama
+    return ChatOllama(
+        model = "llama3.2:latest"
+    )
+
+
+@lru_cache(maxsize=None)
+def get_gemini_model():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model = "gemini-2.0-flash",
+        temperature= 0.7,
+        api_key= os.getenv("GEMINI_API_KEY")
+    )
+
+
+_LAZY_MODELS = {
+    "model": get_model,
+    "vision_model": get_vision_model,
+    "ollama_model": get_ollama_model,
+    "gemini_model": get_gemini_model,
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_MODELS:
+        return _LAZY_MODELS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
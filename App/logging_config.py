@@ -0,0 +1,149 @@
+"""
+Structured Logging
+
+Request handlers only put records on an in-memory queue (QueueHandler); a
+QueueListener thread formats them and does the disk and console writes, so
+logging never blocks the event loop.
+
+The log file gets one JSON object per line. Messages in the repo's
+"TAG | key=value | ..." style are split into an `event` and its fields:
+
+    {"ts": "...", "level": "INFO", "logger": "main", "event": "SEARCH_RESULTS",
+     "query": "'cheap shoes'", "count": "5", "message": "SEARCH_RESULTS | ..."}
+
+Noisy categories are sampled before they are queued (keep 1 in N, per
+category; warnings and errors are always kept), and the file rotates by size.
+
+Environment:
+    LOG_FILE           path of the JSON-lines log (default search_logs.log)
+    LOG_MAX_BYTES      rotate after this many bytes (default 10 MB)
+    LOG_BACKUP_COUNT   rotated files to keep (default 5)
+    LOG_SAMPLING       "CATEGORY=N,..." overrides for DEFAULT_SAMPLING; N=1 keeps all
+"""
+
+from datetime import datetime, timezone
+import atexit
+import copy
+import itertools
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+
+# Keep 1 in N records of these categories. "HTTP Request" is httpx logging
+# every Qdrant/Groq round trip.
+DEFAULT_SAMPLING = {
+    "TRACK_EVENT": 10,
+    "HTTP Request": 20,
+}
+
+_listener = None
+
+
+def parse_sampling(spec: str) -> dict:
+    """Parse "TRACK_EVENT=10,HTTP Request=20" into {category: N}."""
+    rates = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        category, _, every = item.rpartition("=")
+        rates[category.strip()] = max(1, int(every))
+    return rates
+
+
+def category(message: str) -> str:
+    """The event tag of a "TAG | ..." message, or the text before the first colon (httpx)."""
+    head = message.split(" |", 1)[0]
+    if head != message:
+        return head.strip()
+    return message.split(":", 1)[0].strip()
+
+
+class SamplingFilter(logging.Filter):
+    """Let through 1 in N records of each sampled category."""
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        # itertools.count is atomic under the GIL, so this needs no lock
+        self._counters = {name: itertools.count() for name in rates}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        name = category(record.getMessage())
+        every = self.rates.get(name)
+        if every is None or every == 1:
+            return True
+        return next(self._counters[name]) % every == 0
+
+
+class _QueueHandler(QueueHandler):
+    """Like QueueHandler, but keeps the traceback out of the message so it gets its own JSON field."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with "TAG | key=value" messages split into fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        parts = message.split(" | ")
+        if len(parts) > 1:
+            entry["event"] = parts[0]
+            for part in parts[1:]:
+                key, sep, value = part.partition("=")
+                if sep and key.isidentifier() and key not in entry:
+                    entry[key] = value
+        entry["message"] = message
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=logging.INFO) -> QueueListener:
+    """
+    Route the root logger through a queue to a background writer thread.
+    Safe to call more than once; the first call wins.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = RotatingFileHandler(
+        os.getenv("LOG_FILE", "search_logs.log"),
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    rates = {**DEFAULT_SAMPLING, **parse_sampling(os.getenv("LOG_SAMPLING", ""))}
+    queue_handler = _QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = QueueListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,288 @@
+"""
+Prometheus Metrics
+
+A small in-process metrics registry rendered in the Prometheus text format
+at /metrics. Every stage of search and tracking (vision call, refine_query,
+embedding, Qdrant calls, make_choice, response formatting) is timed with
+
+    with metrics.stage("qdrant_query_points"):
+        ...
+
+which feeds a latency histogram, an error counter and an in-flight gauge
+labelled by stage. Cache hit ratios are read from the caches' own `stats()`
+at scrape time, so the request path does no extra work for them.
+
+All recording happens on the event loop thread (blocking work is timed
+around its `asyncio.to_thread` call), so updates are plain attribute writes
+with no locks.
+
+The same calls feed the opt-in per-request waterfall: inside
+`with metrics.waterfall() as timing:` every stage is also recorded as a span
+(start offset, duration and any keyword attributes passed to `stage()`),
+and `timing.report()` returns them in start order. `span()` records a
+waterfall-only span around several stages. Tasks spawned inside the
+block inherit it through the context, so concurrent stages show up too.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+
+# Seconds; spans sub-millisecond cache hits up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+            for values, child in self._children.items()
+        ]
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _samples(self):
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._caches = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_cache(self, name: str, stats):
+        """`stats` returns a dict with "hits" and "misses" (the caches' stats() methods)."""
+        self._caches[name] = stats
+
+    def _cache_lines(self) -> list:
+        if not self._caches:
+            return []
+        hits, misses, ratios = [], [], []
+        for name, stats in self._caches.items():
+            data = stats()
+            label = f'{{cache="{name}"}}'
+            lookups = data["hits"] + data["misses"]
+            hits.append(f"cache_hits_total{label} {data['hits']}")
+            misses.append(f"cache_misses_total{label} {data['misses']}")
+            ratios.append(f"cache_hit_ratio{label} {_format_value(data['hits'] / lookups if lookups else 0.0)}")
+        return [
+            "# HELP cache_hits_total Cache lookups answered from the cache.", "# TYPE cache_hits_total counter",
+            *hits,
+            "# HELP cache_misses_total Cache lookups that fell through.", "# TYPE cache_misses_total counter",
+            *misses,
+            "# HELP cache_hit_ratio Hits / lookups since start.", "# TYPE cache_hit_ratio gauge",
+            *ratios,
+        ]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(self._cache_lines())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "stage_duration_seconds", "Latency of one pipeline stage.", ("stage",)
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "stage_errors_total", "Pipeline stage calls that raised.", ("stage",)
+))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge(
+    "stage_in_flight", "Pipeline stage calls currently running.", ("stage",)
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Latency of API requests.", ("path", "method", "status")
+))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "API requests currently being served."
+))
+
+
+class Waterfall:
+    """Spans recorded for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def add(self, name: str, started: float, duration: float, attrs: dict, error: bool):
+        span = {
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+            **attrs,
+        }
+        if error:
+            span["error"] = True
+        self.spans.append(span)
+
+    def report(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+
+_waterfall: ContextVar = ContextVar("waterfall", default=None)
+
+
+@contextmanager
+def waterfall(enabled: bool = True):
+    """Record every stage run inside the block; yields the Waterfall (None when not enabled)."""
+    if not enabled:
+        yield None
+        return
+    timing = Waterfall()
+    token = _waterfall.set(timing)
+    try:
+        yield timing
+    finally:
+        _waterfall.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Record a block in the request waterfall only (no metrics). Yields `attrs`,
+    which the block may extend with what it learns (e.g. where a result came from).
+    """
+    timing = _waterfall.get()
+    if timing is None:
+        yield attrs
+        return
+    started = time.perf_counter()
+    error = False
+    try:
+        yield attrs
+    except Exception:
+        error = True
+        raise
+    finally:
+        timing.add(name, started, time.perf_counter() - started, attrs, error)
+
+
+@contextmanager
+def stage(name: str, **attrs):
+    """
+    Time a block as pipeline stage `name`. `attrs` (e.g. limits, batch sizes)
+    only go to the request waterfall, never into metric labels.
+    """
+    in_flight = STAGE_IN_FLIGHT.labels(name)
+    in_flight.inc()
+    started = time.perf_counter()
+    try:
+        with span(name, **attrs) as span_attrs:
+            yield span_attrs
+    except Exception:
+        STAGE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+        in_flight.dec()
@@ -0,0 +1,65 @@
+"""
+Shared Qdrant clients.
+
+Every searcher, tracker and feed helper in the process gets its client from
+here, so there is one connection pool per Qdrant URL instead of one per
+object. Configuration comes from the environment:
+
+- QDRANT_URL / QDRANT_API_KEY
+- QDRANT_TIMEOUT: request timeout in seconds (default 30)
+- QDRANT_POOL_SIZE: max connections per client (default 32)
+- QDRANT_PREFER_GRPC=1: use gRPC (port QDRANT_GRPC_PORT, default 6334) instead of REST
+
+Embedding models are not tied to a client; they are loaded once per process
+by App.embeddings.
+"""
+
+import os
+import threading
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+
+_clients = {}
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def client_kwargs(url: str = None, **overrides) -> dict:
+    """Constructor kwargs for QdrantClient / AsyncQdrantClient from the environment."""
+    kwargs = {
+        "url": url or os.getenv("QDRANT_URL", "http://localhost:6333"),
+        "api_key": os.getenv("QDRANT_API_KEY"),
+        "timeout": int(os.getenv("QDRANT_TIMEOUT", "30")),
+        "pool_size": int(os.getenv("QDRANT_POOL_SIZE", "32")),
+        "prefer_grpc": os.getenv("QDRANT_PREFER_GRPC", "0") == "1",
+    }
+    if kwargs["prefer_grpc"]:
+        kwargs["grpc_port"] = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+    kwargs.update(overrides)
+    return kwargs
+
+
+def get_client(url: str = None) -> QdrantClient:
+    """Process-wide QdrantClient for `url` (default QDRANT_URL)."""
+    kwargs = client_kwargs(url)
+    with _lock:
+        if kwargs["url"] not in _clients:
+            _clients[kwargs["url"]] = QdrantClient(**kwargs)
+        return _clients[kwargs["url"]]
+
+
+def get_async_client(url: str = None) -> AsyncQdrantClient:
+    """Process-wide AsyncQdrantClient for `url` (default QDRANT_URL)."""
+    kwargs = client_kwargs(url)
+    with _lock:
+        if kwargs["url"] not in _async_clients:
+            _async_clients[kwargs["url"]] = AsyncQdrantClient(**kwargs)
+        return _async_clients[kwargs["url"]]
+
+
+async def close_async_clients():
+    with _lock:
+        clients = list(_async_clients.values())
+        _async_clients.clear()
+    for client in clients:
+        await client.close()
@@ -0,0 +1,146 @@
+"""
+Rule-based Query Refinement
+
+Queries like "headphones under $50" or "laptop budget 800" don't need a 70B
+LLM round trip to extract a price cap and a category. `QueryParser` handles
+these common shapes locally and returns the same
+{"semantic_query", "filters", "keywords"} dict as the `query_refinement`
+prompt. Anything it is not sure about returns None, and the caller falls back
+to the LLM.
+"""
+
+import re
+import threading
+
+# An amount must not run into a unit or another number ("50 inches", "16gb",
+# "1,200" cut short by backtracking); only "k" and USD markers may follow.
+_NOT_A_UNIT = r"(?!\s*(?:[\d%€£¥₹\"']|[.,]\d|(?!k\b|usd\b|dollars?\b|bucks\b)[a-z]))"
+
+# "under $50", "below 50 dollars", "less than 1,200", "budget 800", "max $1.2k", "for $30"
+_PRICE_PATTERN = re.compile(
+    r"""
+    (?:
+        \b(?:under|below|less\s+than|cheaper\s+than|max(?:imum)?|up\s+to|at\s+most|
+            within|budget(?:\s+of)?|for)\s*
+        |<\s*=?\s*
+    )
+    \$?\s*(?P<amount>\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)""" + _NOT_A_UNIT + r"""\s*(?P<k>k\b)?
+    \s*(?:\$|usd\b|dollars?\b|bucks\b)?
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+# A bare "$50" / "50$" / "50 dollars" with no preposition
+_BARE_PRICE_PATTERN = re.compile(
+    r"""
+    (?:\$\s*(?P<a1>\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)""" + _NOT_A_UNIT + r"""\s*(?P<k1>k\b)?)
+    |(?:\b(?P<a2>\d{1,3}(?:,\d{3})+|\d+(?:\.\d+)?)\s*(?P<k2>k\b)?\s*(?:\$|usd\b|dollars?\b|bucks\b))
+    """,
+    re.IGNORECASE | re.VERBOSE,
+)
+
+# Anything hinting at installments, comparisons, approximate prices ("around 80"
+# is not a cap) or open questions goes to the LLM, as do numbers with a unit
+# ("50 inches", "16gb", "5m") and non-USD currencies
+_DEFER_PATTERN = re.compile(
+    r"\b(month|monthly|mo|installments?|per|vs|versus|compare|or|which|what|how|why|should|between|and|"
+    r"around|about|roughly|approximately)\b|/|\?"
+    r"|\d\s*(?:inch(?:es)?|in|gb|tb|mb|kb|ghz|mhz|hz|mah|wh|w|watts?|v|volts?|m|cm|mm|km|ft|feet|foot|"
+    r"meters?|metres?|lbs?|kg|g|grams?|oz|l|liters?|litres?|ml|mp|p|pcs|pack|pieces?|x|%|\"|')(?![a-z])"
+    r"|\b(euros?|eur|pounds?|gbp|yen|jpy|yuan|cny|rupees?|inr|rs|dinars?|tnd|dirhams?|aed|francs?|chf|cad|aud)\b"
+    r"|[€£¥₹]",
+    re.IGNORECASE,
+)
+
+_FILLER_WORDS = {
+    "a", "an", "the", "some", "me", "i", "im", "i'm", "want", "need", "looking",
+    "find", "show", "buy", "get", "good", "best", "cheap", "affordable", "new",
+    "please", "price", "priced", "with", "my", "is", "of",
+}
+
+MAX_CATEGORY_WORDS = 4
+
+
+def _to_amount(amount: str, thousands: str) -> float:
+    value = float(amount.replace(",", ""))
+    return value * 1000 if thousands else value
+
+
+class QueryParser:
+    """
+    Deterministic parser for simple "<product> <price cap>" queries.
+
+    Keeps counters of how many queries it answered itself.
+    """
+
+    def __init__(self):
+        self.handled = 0
+        self.deferred = 0
+        self._lock = threading.Lock()
+
+    def _count(self, handled: bool):
+        with self._lock:
+            if handled:
+                self.handled += 1
+            else:
+                self.deferred += 1
+
+    @staticmethod
+    def _parse(query: str):
+        if _DEFER_PATTERN.search(query):
+            return None
+
+        match = _PRICE_PATTERN.search(query)
+        if match:
+            max_price = _to_amount(match.group("amount"), match.group("k"))
+        else:
+            match = _BARE_PRICE_PATTERN.search(query)
+            if not match:
+                # No explicit budget: the LLM estimates a market-reasonable range
+                return None
+            max_price = _to_amount(match.group("a1") or match.group("a2"), match.group("k1") or match.group("k2"))
+
+        rest = (query[:match.start()] + " " + query[match.end():]).lower()
+        if _PRICE_PATTERN.search(rest) or _BARE_PRICE_PATTERN.search(rest):
+            # More than one price mentioned
+            return None
+        words = [w for w in re.findall(r"[a-z][a-z'\-]*", rest) if w not in _FILLER_WORDS]
+        if not words or len(words) > MAX_CATEGORY_WORDS or re.search(r"\d", rest):
+            return None
+
+        category = " ".join(words)
+        return {
+            "semantic_query": category,
+            "filters": {"max_price": max_price, "monthly_allowance": None, "category": category},
+            "keywords": words,
+        }
+
+    def parse(self, query: str):
+        """
+        Refinement dict for a simple query, or None if the LLM should decide.
+
+        >>> parser = QueryParser()
+        >>> parser.parse("headphones under $50")["filters"]["max_price"]
+        50.0
+        >>> parser.parse("laptop budget 1.2k")["filters"]["max_price"]
+        1200.0
+        >>> parser.parse("sofa under 1,200 dollars")["filters"]["max_price"]
+        1200.0
+        >>> [parser.parse(q) for q in ("tv under 50 inches", "ram under 16gb", "cable under 5m",
+        ...                            "running shoes under 100 euros", "kettle under £30")]
+        [None, None, None, None, None]
+        >>> [parser.parse(q) for q in ("shoes around 80", "jacket about $80")]
+        [None, None]
+        """
+        result = self._parse(query or "")
+        self._count(result is not None)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.handled + self.deferred
+            return {
+                "handled": self.handled,
+                "deferred": self.deferred,
+                "handled_rate": round(self.handled / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,133 @@
+"""
+Semantic LLM Response Cache
+
+`Pipeline.refine_query` and `Pipeline.make_choice` call the 70B Groq model on
+every request, even for near-identical queries ("cheap laptop" vs "cheap
+laptops"). This cache looks previous answers up by cosine similarity of the
+query's MiniLM embedding, which the hybrid search computes (and caches)
+anyway.
+
+Entries live in one preallocated NumPy matrix of normalized vectors, so a
+lookup is a single matrix-vector product. An optional `context_key` must
+match exactly. Embeddings barely tell "laptop under 500" from "laptop under
+800", so both caches key on the query's numbers (`numeric_key`), and
+make_choice adds the budget and the candidate product set (`choice_key`).
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Similarity-keyed cache with size (LRU) and TTL eviction.
+    """
+
+    def __init__(self, name: str, threshold: float = 0.95, max_size: int = 2048,
+                 ttl_seconds: float = 3600, dim: int = 384):
+        self.name = name
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._vectors = np.zeros((max_size, dim), dtype=np.float32)
+        self._values = [None] * max_size
+        self._context_keys = [None] * max_size
+        self._expires_at = np.zeros(max_size, dtype=np.float64)
+        self._last_used = np.zeros(max_size, dtype=np.float64)
+        self._used = np.zeros(max_size, dtype=bool)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, vector, context_key: str = None):
+        """Return the cached value of the most similar entry above threshold, else None."""
+        query = self._normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            live = self._used & (self._expires_at > now)
+            if context_key is not None:
+                live &= np.fromiter(
+                    (key == context_key for key in self._context_keys),
+                    dtype=bool, count=self.max_size
+                )
+            if live.any():
+                scores = np.where(live, self._vectors @ query, -1.0)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._last_used[best] = now
+                    self.hits += 1
+                    return self._values[best]
+            self.misses += 1
+            return None
+
+    def _free_slot(self, now: float) -> int:
+        free = np.flatnonzero(~self._used)
+        if free.size:
+            return int(free[0])
+        expired = np.flatnonzero(self._expires_at <= now)
+        self.evictions += 1
+        if expired.size:
+            return int(expired[0])
+        return int(np.argmin(self._last_used))
+
+    def store(self, vector, value, context_key: str = None):
+        now = time.monotonic()
+        with self._lock:
+            slot = self._free_slot(now)
+            self._vectors[slot] = self._normalize(vector)
+            self._values[slot] = value
+            self._context_keys[slot] = context_key
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+            self._used[slot] = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": int(self._used.sum()),
+                "max_size": self.max_size,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_NUMBER_PATTERN = re.compile(r"\d[\d,.]*k?", re.IGNORECASE)
+
+
+def numeric_key(query: str) -> str:
+    """The numbers of a query ("500", "1.2k"), in order."""
+    return ",".join(_NUMBER_PATTERN.findall((query or "").lower()))
+
+
+def choice_key(query: str, products: list, financial_context=None) -> str:
+    """Context key of a make_choice answer: query numbers, budget and candidate set."""
+    budget = (
+        (financial_context.max_budget, financial_context.monthly_allowance)
+        if financial_context is not None else (None, None)
+    )
+    return f"{numeric_key(query)}|{budget[0]}|{budget[1]}|{product_set_key(products)}"
+
+
+def product_set_key(products: list) -> str:
+    """Order-independent key of a candidate product set."""
+    identities = sorted(
+        product.get("product_url") or json.dumps(product, sort_keys=True, default=str)
+        for product in products
+    )
+    return hashlib.sha1("\n".join(identities).encode()).hexdigest()
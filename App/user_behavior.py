@@ -10,15 +10,144 @@ It creates user preference vectors based on:
 These vectors can be used to re-rank search results and provide personalized recommendations.
 """
 
-from qdrant_client import QdrantClient, models
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
+from qdrant_client import models
+from collections import OrderedDict
 from datetime import datetime
+import asyncio
 import hashlib
+import heapq
 import logging
+import os
+import time
+
+import numpy as np
+
+from App import embeddings, metrics, qdrant
+from App.bootstrap import BEHAVIORS
 
 logger = logging.getLogger(__name__)
 
 
+class SessionProfile:
+    """
+    Running preference profile of one session, updated one event at a time.
+    
+    Holds everything the feed and recommendation endpoints need, so they no
+    longer scroll and re-aggregate the session's history on every request:
+    - interest_scores: category/query -> summed event weight
+    - recent_interests: distinct queries/categories, newest first
+    - a weight-decayed centroid of the session's behavior vectors
+    """
+    
+    RECENT_LIMIT = 20
+    # Each new event scales older vectors by this much, so recent intent dominates
+    CENTROID_DECAY = 0.9
+    
+    def __init__(self):
+        self.interest_scores = {}
+        self.recent_interests = []
+        self.vector_sum = None
+        self.total_weight = 0.0
+        self.event_count = 0
+    
+    @classmethod
+    def from_behaviors(cls, behaviors: list, vectors: list = None) -> "SessionProfile":
+        """Build a profile from stored behavior payloads (newest first)."""
+        profile = cls()
+        vectors = vectors or [None] * len(behaviors)
+        # Replay oldest -> newest so recency ends up right
+        for behavior, vector in reversed(list(zip(behaviors, vectors))):
+            profile.add(
+                behavior.get("event_type", ""),
+                behavior.get("data", {}),
+                behavior.get("weight", 0.2),
+                vector
+            )
+        return profile
+    
+    def add(self, event_type: str, data: dict, weight: float, vector=None):
+        # Use category if available, otherwise use search query
+        interest = data.get("category") or ""
+        if not interest and event_type == "search":
+            interest = data.get("query") or ""
+        # Normalize interest text
+        interest = interest.strip().lower()
+        if interest:
+            self.interest_scores[interest] = self.interest_scores.get(interest, 0) + weight
+        
+        # Context uses the query for searches and the category for clicks/carts
+        content = ""
+        if event_type == "search":
+            content = data.get("query") or ""
+        elif event_type in ["product_click", "add_to_cart"]:
+            content = data.get("category") or ""
+        content = content.strip().lower()
+        if content:
+            # Keep distinct (to prevent "laptop laptop laptop"), newest first
+            if content in self.recent_interests:
+                self.recent_interests.remove(content)
+            self.recent_interests.insert(0, content)
+            del self.recent_interests[self.RECENT_LIMIT:]
+        
+        if vector is not None:
+            weighted = np.asarray(vector, dtype=np.float32) * weight
+            if self.vector_sum is None:
+                self.vector_sum = weighted
+            else:
+                self.vector_sum = self.vector_sum * self.CENTROID_DECAY + weighted
+            self.total_weight = self.total_weight * self.CENTROID_DECAY + weight
+        
+        self.event_count += 1
+    
+    def top_interests(self, limit: int) -> list:
+        """(interest, score) tuples, highest score first."""
+        return heapq.nlargest(limit, self.interest_scores.items(), key=lambda x: x[1])
+    
+    def context(self, limit: int = None) -> str:
+        """Distinct recent interests as one string, e.g. "laptop t-shirt smartwatch"."""
+        return " ".join(self.recent_interests[:limit])
+    
+    @property
+    def centroid(self):
+        if self.vector_sum is None or self.total_weight == 0:
+            return None
+        return (self.vector_sum / self.total_weight).tolist()
+
+
+class SessionProfileStore:
+    """
+    LRU-bounded map of session_id -> SessionProfile.
+    
+    Profiles expire `ttl_seconds` after they were built, so a long-lived
+    session is periodically rebuilt from what Qdrant holds.
+    """
+    
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 1800):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._profiles = OrderedDict()
+    
+    def get(self, session_id: str):
+        entry = self._profiles.get(session_id)
+        if entry is None:
+            return None
+        profile, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._profiles[session_id]
+            return None
+        self._profiles.move_to_end(session_id)
+        return profile
+    
+    def put(self, session_id: str, profile: SessionProfile):
+        self._profiles[session_id] = (profile, time.monotonic() + self.ttl_seconds)
+        self._profiles.move_to_end(session_id)
+        while len(self._profiles) > self.max_sessions:
+            self._profiles.popitem(last=False)
+    
+    def __len__(self):
+        return len(self._profiles)
+
+
 class UserBehaviorTracker:
     """
     Tracks user behavior and stores it in Qdrant for personalization.
@@ -29,31 +158,19 @@ class UserBehaviorTracker:
     COLLECTION_NAME = "user_behaviors"
     DENSE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
     
+    VECTORS_CONFIG = BEHAVIORS.config["vectors_config"]
+    
     def __init__(self, qdrant_url: str = None):
-        import os
-        if qdrant_url is None:
-            qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
-        self.qdrant_client = QdrantClient(
-            url=qdrant_url,
-            api_key=os.getenv("QDRANT_API_KEY")
-        )
+        self.qdrant_client = qdrant.get_client(qdrant_url)
         self._ensure_collection_exists()
     
     def _ensure_collection_exists(self):
         """Create the user_behaviors collection if it doesn't exist."""
         try:
-            collections = self.qdrant_client.get_collections().collections
-            collection_names = [c.name for c in collections]
-            
-            if self.COLLECTION_NAME not in collection_names:
+            if not self.qdrant_client.collection_exists(self.COLLECTION_NAME):
                 self.qdrant_client.create_collection(
                     collection_name=self.COLLECTION_NAME,
-                    vectors_config={
-                        "behavior": VectorParams(
-                            size=384,  # all-MiniLM-L6-v2 output size
-                            distance=Distance.COSINE
-                        )
-                    }
+                    vectors_config=self.VECTORS_CONFIG
                 )
                 logger.info(f"Created collection: {self.COLLECTION_NAME}")
         except Exception as e:
@@ -102,44 +219,63 @@ class UserBehaviorTracker:
             True if successful, False otherwise
         """
         try:
-            timestamp = datetime.now().isoformat()
-            behavior_text = self._create_behavior_text(event_type, data)
+            point = self._build_point(session_id, event_type, data)
             
-            # Create the point with behavior embedding
-            point_id = self._generate_point_id(session_id, timestamp)
-            
-            # Use Qdrant's built-in embedding
             self.qdrant_client.upsert(
                 collection_name=self.COLLECTION_NAME,
-                points=[
-                    models.PointStruct(
-                        id=point_id,
-                        vector={
-                            "behavior": models.Document(
-                                text=behavior_text,
-                                model=self.DENSE_MODEL
-                            )
-                        },
-                        payload={
-                            "session_id": session_id,
-                            "event_type": event_type,
-                            "data": data,
-                            "behavior_text": behavior_text,
-                            "timestamp": timestamp,
-                            # Weight for importance: cart > click > search
-                            "weight": self._get_event_weight(event_type)
-                        }
-                    )
-                ]
+                points=[point]
             )
             
-            logger.info(f"STORED_BEHAVIOR | session={session_id} | type={event_type} | text='{behavior_text}'")
+            logger.info(f"STORED_BEHAVIOR | session={session_id} | type={event_type} | text='{point.payload['behavior_text']}'")
             return True
             
         except Exception as e:
             logger.error(f"BEHAVIOR_STORE_ERROR | error={str(e)}")
             return False
     
+    def _embed_behaviors(self, texts: list) -> list:
+        model = embeddings.get_model(self.DENSE_MODEL)
+        return [vector.tolist() for vector in model.embed(texts)]
+    
+    def _build_point(
+        self,
+        session_id: str,
+        event_type: str,
+        data: dict,
+        vector: list = None,
+        timestamp: str = None
+    ) -> models.PointStruct:
+        """
+        Build the behavior point.
+        
+        Without a precomputed `vector` the text is embedded with the shared
+        process-wide MiniLM model.
+        """
+        timestamp = timestamp or datetime.now().isoformat()
+        behavior_text = self._create_behavior_text(event_type, data)
+        
+        # Create the point with behavior embedding
+        point_id = self._generate_point_id(session_id, timestamp)
+        
+        if vector is None:
+            vector = self._embed_behaviors([behavior_text])[0]
+        
+        return models.PointStruct(
+            id=point_id,
+            vector={
+                "behavior": vector
+            },
+            payload={
+                "session_id": session_id,
+                "event_type": event_type,
+                "data": data,
+                "behavior_text": behavior_text,
+                "timestamp": timestamp,
+                # Weight for importance: cart > click > search
+                "weight": self._get_event_weight(event_type)
+            }
+        )
+    
     def _get_event_weight(self, event_type: str) -> float:
         """
         Assign weights to different event types.
@@ -159,31 +295,36 @@ class UserBehaviorTracker:
         Returns list of behavior records sorted by recency.
         """
         try:
-            results = self.qdrant_client.scroll(
-                collection_name=self.COLLECTION_NAME,
-                scroll_filter=models.Filter(
-                    must=[
-                        models.FieldCondition(
-                            key="session_id",
-                            match=models.MatchValue(value=session_id)
-                        )
-                    ]
-                ),
-                limit=limit,
-                with_payload=True,
-                with_vectors=False
-            )
-            
-            points = results[0]
-            behaviors = [point.payload for point in points]
-            # Sort by timestamp (newest first)
-            behaviors.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-            return behaviors
+            results = self.qdrant_client.scroll(**self._session_scroll_kwargs(session_id, limit))
+            return self._sorted_behaviors(results[0])
             
         except Exception as e:
             logger.error(f"GET_PREFERENCES_ERROR | error={str(e)}")
             return []
     
+    def _session_scroll_kwargs(self, session_id: str, limit: int, with_vectors: bool = False) -> dict:
+        return dict(
+            collection_name=self.COLLECTION_NAME,
+            scroll_filter=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="session_id",
+                        match=models.MatchValue(value=session_id)
+                    )
+                ]
+            ),
+            limit=limit,
+            with_payload=True,
+            with_vectors=with_vectors
+        )
+    
+    @staticmethod
+    def _sorted_behaviors(points) -> list:
+        behaviors = [point.payload for point in points]
+        # Sort by timestamp (newest first)
+        behaviors.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+        return behaviors
+    
     def get_personalized_recommendations(self, session_id: str, limit: int = 5) -> list:
         """
         Get product categories the user has shown interest in.
@@ -191,32 +332,12 @@ class UserBehaviorTracker:
         Returns weighted list of preferred categories/products.
         """
         behaviors = self.get_user_preferences(session_id, limit=50)
-        
-        # Aggregate preferences by category/interest with weights
-        interest_scores = {}
-        for behavior in behaviors:
-            event_type = behavior.get("event_type", "")
-            data = behavior.get("data", {})
-            weight = behavior.get("weight", 0.2)
-            
-            # Use category if available, otherwise use search query
-            interest = data.get("category", "")
-            if not interest and event_type == "search":
-                interest = data.get("query", "")
-            
-            if interest:
-                # Normalize interest text
-                interest = interest.strip().lower()
-                interest_scores[interest] = interest_scores.get(interest, 0) + weight
-        
-        # Sort by score and return top interests
-        sorted_interests = sorted(
-            interest_scores.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )
-        
-        return sorted_interests[:limit]
+        return self._aggregate_interests(behaviors, limit)
+    
+    @staticmethod
+    def _aggregate_interests(behaviors: list, limit: int) -> list:
+        """Score interests by summed event weight, highest first."""
+        return SessionProfile.from_behaviors(behaviors).top_interests(limit)
 
     def get_cumulative_context(self, session_id: str, limit: int = 15) -> str:
         """
@@ -226,31 +347,148 @@ class UserBehaviorTracker:
         """
         # Get more history to ensure we capture diverse interests
         behaviors = self.get_user_preferences(session_id, limit=limit)
+        return self._build_context(behaviors)
+    
+    @staticmethod
+    def _build_context(behaviors: list) -> str:
+        """Join the distinct queries/categories of `behaviors`, newest first."""
+        return SessionProfile.from_behaviors(behaviors).context()
+
+
+class AsyncUserBehaviorTracker(UserBehaviorTracker):
+    """
+    UserBehaviorTracker on top of AsyncQdrantClient.
+    
+    The collection check cannot run in __init__ here; the app's startup
+    Bootstrapper (App/bootstrap.py) ensures the collection and its indexes.
+    
+    Keeps an LRU of SessionProfile objects that `track_events` updates
+    incrementally; a session missing from it (or expired) is rebuilt from
+    Qdrant on first read. Events flushed while a rebuild's scroll is in
+    flight are held and folded in afterwards, unless the scroll already saw them.
+    """
+    
+    # How much history a profile rebuild reads back from Qdrant
+    PROFILE_REBUILD_LIMIT = 100
+    
+    def __init__(self, qdrant_url: str = None, max_profiles: int = None, profile_ttl: float = None):
+        self.qdrant_client = qdrant.get_async_client(qdrant_url)
+        if max_profiles is None:
+            max_profiles = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+        if profile_ttl is None:
+            profile_ttl = float(os.getenv("PROFILE_TTL", "1800"))
+        self.profiles = SessionProfileStore(max_profiles, profile_ttl)
+        # session_id -> rebuild task, and the events stored while it runs
+        self._rebuilds = {}
+        self._pending = {}
+    
+    async def track_event(self, session_id: str, event_type: str, data: dict) -> bool:
+        return await self.track_events([(session_id, event_type, data, datetime.now().isoformat())])
+    
+    async def track_events(self, events: list) -> bool:
+        """
+        Store many behavior events with one batched embedding and one upsert.
         
-        context_parts = []
-        seen_items = set()
+        Args:
+            events: (session_id, event_type, data, timestamp) tuples
         
-        for behavior in behaviors:
-            event_type = behavior.get("event_type")
-            data = behavior.get("data", {})
+        Returns:
+            True if successful, False otherwise
+        """
+        if not events:
+            return True
+        try:
+            texts = [
+                self._create_behavior_text(event_type, data)
+                for _, event_type, data, _ in events
+            ]
+            with metrics.stage("embed", texts=len(texts)):
+                vectors = await asyncio.to_thread(self._embed_behaviors, texts)
+            points = [
+                self._build_point(session_id, event_type, data, vector=vector, timestamp=timestamp)
+                for (session_id, event_type, data, timestamp), vector in zip(events, vectors)
+            ]
+            with metrics.stage("qdrant_upsert", points=len(points)):
+                await self.qdrant_client.upsert(
+                    collection_name=self.COLLECTION_NAME,
+                    points=points
+                )
             
-            # Extract meaningful content
-            content = ""
-            if event_type == "search":
-                content = data.get("query", "")
-            elif event_type in ["product_click", "add_to_cart"]:
-                # Use category as the primary signal
-                content = data.get("category", "")
-                
-            content = content.strip().lower()
+            logger.info(f"STORED_BEHAVIOR_BATCH | count={len(points)}")
             
-            # Add to context if valid and not a duplicate (to prevent "laptop laptop laptop")
-            if content and content not in seen_items:
-                context_parts.append(content)
-                seen_items.add(content)
-        
-        # specific fallback if no valid behavior found
-        if not context_parts:
-            return ""
+            # Fold the stored events into profiles that are already loaded;
+            # sessions being rebuilt get them after their scroll, other
+            # sessions pick them up from Qdrant on rebuild
+            for point, vector in zip(points, vectors):
+                session_id = point.payload["session_id"]
+                profile = self.profiles.get(session_id)
+                if profile is not None:
+                    profile.add(
+                        point.payload["event_type"],
+                        point.payload["data"],
+                        point.payload["weight"],
+                        vector
+                    )
+                elif session_id in self._pending:
+                    self._pending[session_id].append((point, vector))
+            return True
+            
+        except Exception as e:
+            logger.error(f"BEHAVIOR_STORE_ERROR | count={len(events)} | error={str(e)}")
+            return False
+    
+    async def get_user_preferences(self, session_id: str, limit: int = 10) -> list:
+        try:
+            with metrics.stage("qdrant_scroll", limit=limit):
+                results = await self.qdrant_client.scroll(**self._session_scroll_kwargs(session_id, limit))
+            return self._sorted_behaviors(results[0])
             
-        return " ".join(context_parts)
+        except Exception as e:
+            logger.error(f"GET_PREFERENCES_ERROR | error={str(e)}")
+            return []
+    
+    async def get_profile(self, session_id: str) -> SessionProfile:
+        """Return the session's profile, rebuilding it from Qdrant on a miss."""
+        profile = self.profiles.get(session_id)
+        if profile is not None:
+            return profile
+        # Concurrent readers of the same session share one rebuild
+        task = self._rebuilds.get(session_id)
+        if task is None:
+            task = asyncio.ensure_future(self._rebuild_profile(session_id))
+            self._rebuilds[session_id] = task
+            task.add_done_callback(lambda _: self._rebuilds.pop(session_id, None))
+        return await asyncio.shield(task)
+    
+    async def _rebuild_profile(self, session_id: str) -> SessionProfile:
+        pending = self._pending[session_id] = []
+        try:
+            with metrics.stage("qdrant_scroll", limit=self.PROFILE_REBUILD_LIMIT, with_vectors=True):
+                points, _ = await self.qdrant_client.scroll(
+                    **self._session_scroll_kwargs(session_id, self.PROFILE_REBUILD_LIMIT, with_vectors=True)
+                )
+        except Exception as e:
+            # Don't cache an empty profile for a session we failed to read
+            logger.error(f"PROFILE_REBUILD_ERROR | session={session_id} | error={str(e)}")
+            return SessionProfile()
+        finally:
+            del self._pending[session_id]
+        points = sorted(points, key=lambda p: p.payload.get("timestamp", ""), reverse=True)
+        profile = SessionProfile.from_behaviors(
+            [point.payload for point in points],
+            [(point.vector or {}).get("behavior") for point in points]
+        )
+        # Events stored during the scroll that it did not return
+        seen = {point.id for point in points}
+        for point, vector in pending:
+            if point.id not in seen:
+                profile.add(point.payload["event_type"], point.payload["data"], point.payload["weight"], vector)
+        self.profiles.put(session_id, profile)
+        logger.info(f"PROFILE_REBUILT | session={session_id} | events={profile.event_count}")
+        return profile
+    
+    async def get_personalized_recommendations(self, session_id: str, limit: int = 5) -> list:
+        return (await self.get_profile(session_id)).top_interests(limit)
+    
+    async def get_cumulative_context(self, session_id: str, limit: int = 15) -> str:
+        return (await self.get_profile(session_id)).context(limit)
@@ -2,29 +2,23 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import uvicorn
+import json
 import logging
+import time
 from datetime import datetime
-from App.RAG_pipeline import Pipeline
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from App.RAG_pipeline import AsyncPipeline
+from App import metrics, qdrant
+from App.logging_config import setup_logging
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from typing import Optional
-import shutil
-from pathlib import Path
-
-# Setup logging for observability
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('search_logs.log'),
-        logging.StreamHandler()
-    ]
-)
+
+# Setup logging for observability: JSON lines written from a background thread,
+# with noisy categories sampled (see App/logging_config.py)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = Path("uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
 
@@ -48,37 +42,75 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Import index creation functions (from root directory)
-try:
-    from create_indexes import create_product_index
-    from create_behavior_indexes import create_behavioral_index
-except ImportError:
-    # Fallback if imports fail (e.g. if path issues)
-    logger.error("Could not import index creation scripts")
-    create_product_index = None
-    create_behavioral_index = None
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Latency histogram and in-flight gauge per route (the path template, not the raw URL).
+    Requests are timed until the last body chunk is sent, so SSE streams count in full.
+    """
+    in_flight = metrics.HTTP_IN_FLIGHT.labels()
+    in_flight.inc()
+    started = time.perf_counter()
+
+    def record(status: int):
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.HTTP_SECONDS.labels(path, request.method, status).observe(time.perf_counter() - started)
+        in_flight.dec()
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        record(500)
+        raise
+
+    body = response.body_iterator
+
+    async def timed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            record(response.status_code)
+
+    response.body_iterator = timed_body()
+    return response
+
+from App.bootstrap import Bootstrapper, PRODUCTS, BEHAVIORS
+from App.embeddings import ModelWarmup
+
+# Loads MiniLM, BM25 and ColBERT before the first search needs them
+model_warmup = ModelWarmup()
 
 @app.on_event("startup")
 async def startup_event():
     """
     Run startup tasks:
-    1. Create/Verify Qdrant Indexes
+    1. Start the write-behind behavior event queue
+    2. Ensure Qdrant collections and payload indexes in the background
+    3. Load and test-run the embedding models in the background
+    (readiness of 2 and 3 is reported by /api/health)
     """
     logger.info("Running startup tasks...")
-    try:
-        if create_product_index:
-            logger.info("Initializing product indexes...")
-            create_product_index()
-        
-        if create_behavioral_index:
-            logger.info("Initializing behavioral indexes...")
-            create_behavioral_index()
-            
-    except Exception as e:
-        logger.error(f"Startup task failed: {e}")
+    behavior_queue.start()
+    product_counter.start()
+    bootstrapper.start()
+    if os.getenv("WARMUP_MODELS", "1") == "1":
+        model_warmup.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Drain queued behavior events, then close the shared async Qdrant client."""
+    await bootstrapper.stop()
+    await model_warmup.stop()
+    await behavior_queue.stop()
+    await product_counter.stop()
+    await qdrant.close_async_clients()
 
 # create a pipeline class
-pipeline_rag = Pipeline()
+# Speculative mode overlaps the refinement LLM call with retrieval
+pipeline_rag = AsyncPipeline(speculative=os.getenv("SPECULATIVE_RETRIEVAL", "1") == "1")
 
 
 @app.post("/api/search")
@@ -90,33 +122,22 @@ async def search_products(
     Endpoint to handle text query and/or image upload
     """
     try:
-        image_path = None
-        if image:
-            image_path = UPLOAD_DIR/image.filename
-            with image_path.open("wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
-
         if not query and not image:
             raise HTTPException(status_code=400, detail="Please provide a query or image")
 
         search_query = query if query else ""
+        # The image is processed in memory and its description appended to the query
+        search_query += await describe_upload(image)
 
-        result = pipeline_rag.pipeline(
-            query=search_query,
-            image_path=str(image_path) if image_path else None
-        )
-
-        if image_path and image_path.exists():
-            image_path.unlink()
+        result = await pipeline_rag.pipeline(query=search_query)
 
         return JSONResponse(content={
             "success": True,
             "data": result
         })
+    except HTTPException:
+        raise
     except Exception as e:
-        if image_path and image_path.exists():
-            image_path.unlink()
-
         return JSONResponse(
             status_code=500,
             content={
@@ -130,11 +151,47 @@ async def root():
     return {"message": "Product Search API is running"}
 
 
+@app.get("/api/health")
+async def health():
+    """
+    Readiness: 200 once the Qdrant collections and indexes are in place and
+    the embedding models are loaded, 503 before.
+    """
+    status = bootstrapper.status()
+    if os.getenv("WARMUP_MODELS", "1") == "1":
+        status["embedding_models"] = model_warmup.status()
+        status["ready"] = status["ready"] and model_warmup.ready
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+
+@app.get("/api/cache-stats")
+async def cache_stats():
+    """Hit/miss statistics of the shared query-embedding cache."""
+    from App.embeddings import query_embedding_cache
+    return {
+        "embedding_cache": query_embedding_cache.stats(),
+        "behavior_queue": behavior_queue.stats(),
+        "personalized_feed": personalized_feed_cache.stats(),
+        "llm_refinement": pipeline_rag.refinement_cache.stats(),
+        "llm_choice": pipeline_rag.choice_cache.stats(),
+        "query_parser": pipeline_rag.query_parser.stats(),
+        "image_descriptions": pipeline_rag.image_description_cache.stats(),
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Per-stage latency histograms, in-flight gauges and cache hit ratios (Prometheus text format)."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 # Behavior tracking endpoint for user actions
-from App.user_behavior import UserBehaviorTracker
+from App.user_behavior import AsyncUserBehaviorTracker
+from App import behavior_queue as behavior_queue_module
 
-# Initialize the tracker
-user_tracker = UserBehaviorTracker()
+# Initialize the tracker and the write-behind queue in front of it
+user_tracker = AsyncUserBehaviorTracker()
+behavior_queue = behavior_queue_module.from_env(user_tracker)
 
 @app.post("/api/track")
 async def track_event(request: Request):
@@ -148,14 +205,22 @@ async def track_event(request: Request):
         timestamp = data.get('timestamp', datetime.now().isoformat())
         
         # Log the event for observability
-        logger.info(f"TRACK_EVENT | session={session_id} | type={event_type} | data={data} | time={timestamp}")
+        # Only the field names: the payload itself is stored in Qdrant.
+        # The frontend sends event fields at the top level of the body.
+        fields = sorted(k for k in data if k not in ("session_id", "event_type", "timestamp"))
+        logger.info(f"TRACK_EVENT | session={session_id} | type={event_type} | fields={fields} | time={timestamp}")
         
-        # Store in Qdrant
-        user_tracker.track_event(session_id, event_type, data)
+        # Queue for batched storage in Qdrant (write-behind)
+        if not await behavior_queue.submit(session_id, event_type, data):
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": "1"},
+                content={"success": False, "error": "Tracking queue is full, retry later"}
+            )
         
         return JSONResponse(content={
             "success": True,
-            "message": "Event tracked and stored successfully"
+            "message": "Event queued for storage"
         })
     except Exception as e:
         logger.error(f"TRACK_ERROR | error={str(e)}")
@@ -164,25 +229,77 @@ async def track_event(request: Request):
             content={"success": False, "error": str(e)}
         )
 
+@app.post("/api/track/batch")
+async def track_events_batch(request: Request):
+    """
+    Track many behavior events in one request.
+    Body: {"events": [<event>, ...]} (or a bare list), each event shaped like /api/track
+    """
+    try:
+        body = await request.json()
+        events = body.get("events", []) if isinstance(body, dict) else body
+        if not isinstance(events, list):
+            raise HTTPException(status_code=400, detail="'events' must be a list")
+        invalid = [i for i, data in enumerate(events) if not isinstance(data, dict)]
+        if invalid:
+            raise HTTPException(status_code=422, detail=f"Events must be JSON objects (invalid at index {invalid[:10]})")
+        
+        accepted = 0
+        for data in events:
+            session_id = data.get('session_id', 'anonymous')
+            event_type = data.get('event_type', 'unknown')
+            if not await behavior_queue.submit(session_id, event_type, data):
+                break
+            accepted += 1
+        
+        logger.info(f"TRACK_BATCH | received={len(events)} | accepted={accepted}")
+        
+        if accepted < len(events):
+            return JSONResponse(
+                status_code=503,
+                headers={"Retry-After": "1"},
+                content={
+                    "success": False,
+                    "accepted": accepted,
+                    "error": "Tracking queue is full, retry the remaining events later"
+                }
+            )
+        return JSONResponse(content={"success": True, "accepted": accepted})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"TRACK_BATCH_ERROR | error={str(e)}")
+        return JSONResponse(
+            status_code=500,
+            content={"success": False, "error": str(e)}
+        )
+
+RECOMMENDATION_LIMIT = 4
+
 @app.get("/api/recommendations")
-async def get_recommendations(session_id: str):
+async def get_recommendations(session_id: str, profile: Optional[str] = None):
     """
     Get personalized recommendations based on user's session history
     """
+    params = resolve_profile(profile, RECOMMENDATION_RETRIEVAL_PROFILE)
     try:
-        # Get cumulative user context (e.g. "laptop t-shirt shoes")
-        user_context_query = user_tracker.get_cumulative_context(session_id, limit=20)
+        session_profile = await user_tracker.get_profile(session_id)
+        user_vector = session_profile.centroid
         
-        if not user_context_query:
+        if user_vector is not None:
+            # The session's behavior vectors live in the same MiniLM space as the
+            # products' text-dense vectors, so query with their decayed average directly
+            results = await hybrid_searcher.search_by_vector(user_vector, limit=RECOMMENDATION_LIMIT)
+            reason = "Based on your activity history"
+        elif session_profile.context():
+            # History without stored vectors: fall back to the cumulative context text
+            results = await hybrid_searcher.search(session_profile.context(), limit=RECOMMENDATION_LIMIT, params=params)
+            reason = "Based on your activity history"
+        else:
             # Fallback for new users: Return "Trending" products
             # In a real app, this would be computed from global popularity
-            results = hybrid_searcher.search("best selling electronics fashion", limit=12)
+            results = await hybrid_searcher.search("best selling electronics fashion", limit=RECOMMENDATION_LIMIT, params=params)
             reason = "Trending Products"
-        else:
-            # Use the cumulative context to find products matching ANY of the user's interests
-            # The hybrid searcher's embedding model will find vectors close to this 'mixed' profile
-            results = hybrid_searcher.search(user_context_query, limit=12)
-            reason = "Based on your activity history"
             
         # Format results
         products = []
@@ -199,7 +316,7 @@ async def get_recommendations(session_id: str):
             
         return JSONResponse(content={
             "success": True,
-            "data": products[:4], # Return top 4 personalized picks
+            "data": products[:RECOMMENDATION_LIMIT], # Return top 4 personalized picks
             "reason": reason
         })
     except Exception as e:
@@ -208,243 +325,407 @@ async def get_recommendations(session_id: str):
 
 
 # New endpoint for test2 frontend - returns structured product data
-from App.Hybrid_Search import HybridSearcher
+from App.Hybrid_Search import AsyncHybridSearcher, FinancialContext, retrieval_profile
+
+# Retrieval profile per surface ("fast" = RRF only, "balanced" = ColBERT rerank, "deep" = wider HNSW + prefetch).
+# Requests can override with a `profile` parameter.
+FEED_RETRIEVAL_PROFILE = os.getenv("FEED_RETRIEVAL_PROFILE", "fast")
+RECOMMENDATION_RETRIEVAL_PROFILE = os.getenv("RECOMMENDATION_RETRIEVAL_PROFILE", "fast")
+
+
+def resolve_profile(name: Optional[str], default: Optional[str] = None):
+    """RetrievalParams for a request's `profile`; None (with no default) leaves the pipeline's own."""
+    if name is None and default is None:
+        return None
+    try:
+        return retrieval_profile(name, default)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+from App.feed import (
+    CollectionCounter,
+    InvalidPageToken,
+    PersonalizedFeedCache,
+    ScrollPager,
+    decode_page_token,
+    encode_page_token,
+)
+
+hybrid_searcher = AsyncHybridSearcher("products")
+
+def format_search_products(results, financial_context: Optional[FinancialContext] = None):
+    """
+    Turn search hits into product cards tagged with how they fit the budget.
+    The budget rules are already applied by Qdrant (see FinancialContext).
+    """
+    financial_context = financial_context or FinancialContext()
+    products = []
+    with metrics.stage("format_response"):
+        for i, product in enumerate(results):
+            price = product.get("discounted_price", 0)
+            fit = financial_context.classify(price)
+            if fit is None:
+                # Too expensive (only possible for hits fetched without the budget filter)
+                continue
+            match_type, message = fit
+            products.append({
+                "id": i,
+                "category": product.get("category", "Unknown"),
+                "rating": product.get("rating", 0),
+                "actual_price": product.get("actual_price", 0),
+                "discounted_price": price,
+                "image_url": product.get("image_url", "").strip('"'),
+                "product_url": product.get("product_url", ""),
+                "match_type": match_type,
+                "message": message
+            })
+    return products
+
+
+# Larger uploads are rejected before they are read into memory
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+
+
+async def read_upload(image: UploadFile) -> bytes:
+    """Read an upload, raising 413 past MAX_UPLOAD_BYTES without buffering the rest."""
+    if image.size is not None and image.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image larger than {MAX_UPLOAD_BYTES} bytes")
+    data = await image.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image larger than {MAX_UPLOAD_BYTES} bytes")
+    return data
+
+
+async def describe_upload(image: Optional[UploadFile]) -> str:
+    """
+    Describe an uploaded image with the vision model, entirely in memory
+    (downscaled before encoding, cached by content hash)
+    """
+    if not image:
+        return ""
+    with metrics.stage("read_upload", bytes=image.size):
+        data = await read_upload(image)
+    try:
+        logger.debug(f"IMAGE_DESC_REQUEST | file={image.filename} | bytes={len(data)}")
+        image_description = await pipeline_rag.describe_image_bytes(data)
+        logger.debug(f"IMAGE_DESC_RESULT | chars={len(image_description)}")
+        return image_description
+    except Exception as e:
+        logger.warning(f"IMAGE_DESC_ERROR | error={str(e)}")
+        return ""
+
+
+def debug_timing_requested(header: Optional[str]) -> bool:
+    return header is not None and header.strip().lower() in ("1", "true", "yes", "on")
+
+
+def json_response(content: dict, timing=None) -> Response:
+    """
+    JSONResponse with its rendering timed as the serialize_response stage.
+    When a waterfall is being recorded, its report is added under "timing".
+    """
+    with metrics.stage("serialize_response"):
+        response = JSONResponse(content=content)
+    if timing is None:
+        return response
+    # Splice the report into the rendered object rather than serializing the payload twice
+    report = json.dumps(timing.report(), separators=(",", ":")).encode()
+    return Response(content=response.body[:-1] + b',"timing":' + report + b"}", media_type="application/json")
 
-hybrid_searcher = HybridSearcher("products")
 
 @app.post("/api/search-products")
 async def search_products_structured(
         query: Optional[str] = Form(None),
         max_budget: Optional[float] = Form(None),
         monthly_allowance: Optional[float] = Form(None),
-        image: Optional[UploadFile] = File(None)
+        image: Optional[UploadFile] = File(None),
+        profile: Optional[str] = Form(None),
+        x_debug_timing: Optional[str] = Header(None)
 ):
     """
     Endpoint to search products and return both AI explanation and structured product data
     Supports financial context (budget filtering) and Image Search
+    With an `X-Debug-Timing: 1` header the response also carries the request's span waterfall
     """
-    try:
-        # Handle image upload and description
-        image_description = ""
-        image_path = None
-        
-        if image:
-            image_path = UPLOAD_DIR/image.filename
-            with image_path.open("wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
-            
-            # Get description from LLM
-            try:
-                # Need to pass 'self' implicitly by calling the method on the instance
-                print(f"DEBUG: describing image {image_path}")
-                image_description = pipeline_rag.describe_image(str(image_path))
-                print(f"DEBUG: image description result: {image_description}")
-            except Exception as e:
-                print(f"DEBUG: Image description failed: {e}")
-                logger.error(f"IMAGE_DESC_ERROR | error={str(e)}")
+    params = resolve_profile(profile)
+    with metrics.waterfall(debug_timing_requested(x_debug_timing)) as timing:
+        try:
+            # Handle image upload and description
+            image_description = await describe_upload(image)
         
-        # Combine user query with image description
-        base_query = query.strip() if query else ""
-        search_query = f"{base_query} {image_description}".strip()
-
-        if not search_query:
-             # Cleanup if no query at all
-            if image_path and image_path.exists():
-                image_path.unlink()
-            raise HTTPException(status_code=400, detail="Please provide a search query or an image")
+            # Combine user query with image description
+            base_query = query.strip() if query else ""
+            search_query = f"{base_query} {image_description}".strip()
+
+            if not search_query:
+                raise HTTPException(status_code=400, detail="Please provide a search query or an image")
         
-        # Log the search for observability
-        logger.info(f"SEARCH_REQUEST | query='{search_query}' | budget={max_budget} | monthly={monthly_allowance}")
+            # Log the search for observability
+            logger.info(f"SEARCH_REQUEST | query='{search_query}' | budget={max_budget} | monthly={monthly_allowance}")
         
-        # Get AI explanation from RAG pipeline
-        ai_response = pipeline_rag.pipeline(
-            query=search_query,
-            image_path=None # We already extracted the description
-        )
+            # Budget rules are pushed into the Qdrant query as one range filter
+            financial_context = FinancialContext(max_budget, monthly_allowance)
+
+            # Get AI explanation and the products it was based on from the RAG pipeline
+            pipeline_result = await pipeline_rag.run(
+                query=search_query,
+                image_path=None, # We already extracted the description
+                financial_context=financial_context,
+                params=params
+            )
+            ai_response = pipeline_result.answer
+
+            # Product cards come from the same hits the LLM saw (single retrieval)
+            # Format and tag results (Soft Filtering)
+            products = format_search_products(pipeline_result.products, financial_context)
+
+            # Log results
+            logger.info(f"SEARCH_RESULTS | query='{search_query}' | count={len(products)}")
+
+            return json_response({
+                "success": True,
+                "ai_response": ai_response,
+                "data": products,
+                "count": len(products)
+            }, timing)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"SEARCH_ERROR | query='{query}' | error={str(e)}")
+            return JSONResponse(
+                status_code=500,
+                content={
+                    "success": False,
+                    "error": str(e)
+                }
+            )
 
-        # Clean up image after processing
-        if image_path and image_path.exists():
-            image_path.unlink()
 
-        # Get products from Qdrant using hybrid search for product cards
-        results = hybrid_searcher.search(search_query)
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-        # Format and categorize results (Soft Filtering)
-        products = []
-        for i, product in enumerate(results):
-            price = product.get("discounted_price", 0)
-            formatted_product = {
-                "id": i,
-                "category": product.get("category", "Unknown"),
-                "rating": product.get("rating", 0),
-                "actual_price": product.get("actual_price", 0),
-                "discounted_price": price,
-                "image_url": product.get("image_url", "").strip('"'),
-                "product_url": product.get("product_url", ""),
-                "match_type": "match",
-                "message": ""
-            }
 
-            # 1. Budget Filter
-            if max_budget:
-                if price <= max_budget:
-                     products.append(formatted_product)
-                
-                # 2. Monthly Installment Filter (Alternative)
-                elif monthly_allowance and (price / 12) <= monthly_allowance:
-                    formatted_product["match_type"] = "alternative_installment"
-                    formatted_product["message"] = f"Fits monthly budget (${price/12:.0f}/mo)"
-                    products.append(formatted_product)
-                
-                # 3. Close Alternative (+25% over budget)
-                elif price <= (max_budget * 1.25):
-                    formatted_product["match_type"] = "alternative_close"
-                    formatted_product["message"] = f"Only ${price - max_budget:.0f} over budget"
-                    products.append(formatted_product)
-                
-                # Else: Hidden (Too expensive)
-            else:
-                # No budget set -> All are matches
-                products.append(formatted_product)
+@app.post("/api/search-products/stream")
+async def search_products_stream(
+        query: Optional[str] = Form(None),
+        max_budget: Optional[float] = Form(None),
+        monthly_allowance: Optional[float] = Form(None),
+        image: Optional[UploadFile] = File(None),
+        profile: Optional[str] = Form(None)
+):
+    """
+    Streaming variant of /api/search-products (Server-Sent Events).
 
-        # Log results
-        logger.info(f"SEARCH_RESULTS | query='{search_query}' | count={len(products)}")
+    Events, in order:
+    - `products`: the formatted product cards, sent as soon as retrieval finishes
+    - `token`: chunks of the AI explanation as the LLM generates them
+    - `done` (or `error`): end of the stream
+    """
+    params = resolve_profile(profile)
+    image_description = await describe_upload(image)
+    base_query = query.strip() if query else ""
+    search_query = f"{base_query} {image_description}".strip()
+
+    if not search_query:
+        raise HTTPException(status_code=400, detail="Please provide a search query or an image")
+
+    logger.info(f"SEARCH_STREAM_REQUEST | query='{search_query}' | budget={max_budget} | monthly={monthly_allowance}")
+
+    financial_context = FinancialContext(max_budget, monthly_allowance)
+
+    async def events():
+        try:
+            async for event in pipeline_rag.stream(search_query, financial_context, params):
+                if event["event"] == "products":
+                    products = format_search_products(event["products"], financial_context)
+                    logger.info(f"SEARCH_RESULTS | query='{search_query}' | count={len(products)}")
+                    yield sse_event("products", {"data": products, "count": len(products)})
+                else:
+                    yield sse_event("token", {"text": event["text"]})
+            yield sse_event("done", {"success": True})
+        except Exception as e:
+            logger.error(f"SEARCH_STREAM_ERROR | query='{search_query}' | error={str(e)}")
+            yield sse_event("error", {"success": False, "error": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Cached product count (refreshed in the background) and cursor pager for the generic feed
+product_counter = CollectionCounter(
+    hybrid_searcher.qdrant_client, "products",
+    refresh_interval=float(os.getenv("PRODUCT_COUNT_REFRESH", "60"))
+)
+product_pager = ScrollPager(hybrid_searcher.qdrant_client, "products")
+# The products collection is filled by ingest_products.py; only its indexes are ensured here
+bootstrapper = Bootstrapper(
+    hybrid_searcher.qdrant_client,
+    [(PRODUCTS, False), (BEHAVIORS, True)],
+    retry_interval=float(os.getenv("BOOTSTRAP_RETRY_INTERVAL", "5")),
+)
 
-        return JSONResponse(content={
-            "success": True,
-            "ai_response": ai_response,
-            "data": products,
-            "count": len(products)
-        })
-    except Exception as e:
-        logger.error(f"SEARCH_ERROR | query='{query}' | error={str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={
-                "success": False,
-                "error": str(e)
-            }
-        )
+# How many candidates the mixed personalized feed fetches up front
+PERSONALIZED_FEED_DEPTH = int(os.getenv("PERSONALIZED_FEED_DEPTH", "96"))
+personalized_feed_cache = PersonalizedFeedCache(
+    ttl_seconds=float(os.getenv("PERSONALIZED_FEED_TTL", "600"))
+)
 
+# Exported as cache_hits_total / cache_misses_total / cache_hit_ratio on /metrics
+from App.embeddings import query_embedding_cache
+metrics.REGISTRY.register_cache("embedding", query_embedding_cache.stats)
+metrics.REGISTRY.register_cache("personalized_feed", personalized_feed_cache.stats)
+metrics.REGISTRY.register_cache("llm_refinement", pipeline_rag.refinement_cache.stats)
+metrics.REGISTRY.register_cache("llm_choice", pipeline_rag.choice_cache.stats)
+metrics.REGISTRY.register_cache("image_descriptions", pipeline_rag.image_description_cache.stats)
+# Queries the rule-based parser answered count as hits (no refinement LLM call)
+metrics.REGISTRY.register_cache("query_parser", lambda: {
+    "hits": pipeline_rag.query_parser.handled,
+    "misses": pipeline_rag.query_parser.deferred,
+})
 
 @app.get("/api/products")
-async def get_all_products(page: int = 1, limit: int = 12, session_id: Optional[str] = None):
+async def get_all_products(
+        page: int = 1,
+        limit: int = 12,
+        session_id: Optional[str] = None,
+        page_token: Optional[str] = None,
+        profile: Optional[str] = None,
+        x_debug_timing: Optional[str] = Header(None)
+):
     """
     Endpoint to fetch products.
     If session_id provided & history exists -> returns MIXED PERSONALIZED FEED.
     Else -> returns generic feed (Scroll).
+    Infinite scroll clients should pass back `next_page_token` instead of `page`.
+    With an `X-Debug-Timing: 1` header the response also carries the request's span waterfall.
     """
-    try:
-        # Get total count (approximation for search, exact for scroll)
-        collection_info = hybrid_searcher.qdrant_client.get_collection("products")
-        total_count = collection_info.points_count
+    profile = profile or FEED_RETRIEVAL_PROFILE
+    params = resolve_profile(profile)
+    with metrics.waterfall(debug_timing_requested(x_debug_timing)) as timing:
+        try:
+            # Cached total count (approximation for search, exact for scroll)
+            total_count = await product_counter.get()
+            next_page_token = None
         
-        # Calculate offset
-        offset = (page - 1) * limit
-
-        # Check for personalization context
-        top_interests = []
-        if session_id:
-            # Get top 3 categories of interest
-            top_interests = user_tracker.get_personalized_recommendations(session_id, limit=3)
-            # top_interests is list of (category, score) tuples
-            print(f"DEBUG: Top interests for session {session_id}: {top_interests}")
-
-        products = []
+            # Calculate offset
+            offset = (page - 1) * limit
+
+            # Check for personalization context
+            top_interests = []
+            if session_id:
+                # Get top 3 categories of interest
+                top_interests = await user_tracker.get_personalized_recommendations(session_id, limit=3)
+                # top_interests is list of (category, score) tuples
+                logger.debug(f"FEED_INTERESTS | session={session_id} | interests={top_interests}")
+
+            products = []
         
-        if top_interests:
-            # MIXED PERSONALIZED FEED
-            logger.info(f"FETCH_FEED | mode=mixed_personalized | session={session_id} | interests={top_interests}")
-            
-            # Strategy: Fetch results for each top category separately and mix them
-            # We split the limit among the categories (e.g., if limit=12 and 2 categories, fetch 6 of each)
-            num_categories = len(top_interests)
-            per_category_limit = max(4, limit // num_categories) # Ensure at least a few per category
+            if top_interests:
+                # MIXED PERSONALIZED FEED
+                logger.info(f"FETCH_FEED | mode=mixed_personalized | session={session_id} | interests={top_interests}")
             
-            category_results = []
-            for category, score in top_interests:
-                # Search for products in this category (boosted by 'best rated')
-                # We add 'best' to ensure high quality items from that category show up
-                query = f"best {category}" 
-                results = hybrid_searcher.search(query, limit=per_category_limit)
-                category_results.append(results)
+                # The interleaved candidate list is built once per session (deep fetch)
+                # and cached; pages are slices of it until the top interests change
+                fingerprint = (personalized_feed_cache.fingerprint(top_interests), profile)
+                mixed_results = personalized_feed_cache.get(session_id, fingerprint)
             
-            # Interleave results: [Cat1-Item1, Cat2-Item1, Cat3-Item1, Cat1-Item2, ...]
-            # Using zip_longest would be ideal, but simple round-robin is fine
-            from itertools import zip_longest
+                if mixed_results is None:
+                    # Strategy: Fetch results for each top category separately and mix them
+                    # We split the feed depth among the categories (e.g. depth 96 and 3 categories -> 32 each)
+                    num_categories = len(top_interests)
+                    per_category_limit = max(limit, PERSONALIZED_FEED_DEPTH // num_categories)
+                
+                    # One batched Qdrant request for all categories
+                    # We add 'best' to ensure high quality items from that category show up
+                    queries = [f"best {category}" for category, score in top_interests]
+                    category_results = await hybrid_searcher.search_batch_points(queries, limit=per_category_limit, params=params)
+                
+                    # Interleave results: [Cat1-Item1, Cat2-Item1, Cat3-Item1, Cat1-Item2, ...]
+                    # Deduplicate on point id so the same product never shows twice
+                    from itertools import zip_longest
+                
+                    mixed_results = []
+                    seen_ids = set()
+                    for points in zip_longest(*category_results):
+                        for point in points:
+                            if point is not None and point.id not in seen_ids:
+                                seen_ids.add(point.id)
+                                mixed_results.append(point.payload)
+                
+                    personalized_feed_cache.put(session_id, fingerprint, mixed_results)
             
-            # Flatten the interleaved list
-            mixed_results = []
-            for items in zip_longest(*category_results):
-                for item in items:
-                    if item:
-                        # Deduplicate based on payload/id if needed, but for now just add
-                        # Check strictly for duplicates to avoid showing same item twice
-                        if item not in mixed_results:
-                            mixed_results.append(item)
+                if page_token:
+                    try:
+                        token_offset, token_page, kind = decode_page_token(page_token)
+                    except InvalidPageToken as e:
+                        raise HTTPException(status_code=400, detail=str(e))
+                    if kind == "mixed":
+                        offset, page = token_offset, token_page
             
-            # Apply offset and limit to the mixed result set
-            # Note: This 'page' logic is imperfect for mixed feeds without a dedicated search engine feature
-            # but works for a hackathon demo. Effectively checks "fresh" mixed results each time.
-            # To make pagination work "better" with this naive mix, we might just slice the front
-            # or regenerate new random ones. For now, we return the first N mixed.
-            results_to_show = mixed_results[:limit]
-
-            for i, product in enumerate(results_to_show):
-                products.append({
-                    "id": offset + i, # Virtual ID
-                    "category": product.get("category", "Unknown"),
-                    "rating": product.get("rating", 0),
-                    "actual_price": product.get("actual_price", 0),
-                    "discounted_price": product.get("discounted_price", 0),
-                    "image_url": product.get("image_url", "").strip('"'),
-                    "product_url": product.get("product_url", "")
-                })
+                results_to_show = mixed_results[offset:offset + limit]
+                total_count = len(mixed_results)
+                if offset + limit < total_count:
+                    next_page_token = encode_page_token(offset + limit, page + 1, kind="mixed")
+
+                for i, product in enumerate(results_to_show):
+                    products.append({
+                        "id": offset + i, # Virtual ID
+                        "category": product.get("category", "Unknown"),
+                        "rating": product.get("rating", 0),
+                        "actual_price": product.get("actual_price", 0),
+                        "discounted_price": product.get("discounted_price", 0),
+                        "image_url": product.get("image_url", "").strip('"'),
+                        "product_url": product.get("product_url", "")
+                    })
                 
-        else:
-            # GENERIC FEED (Fall back to DB scroll)
-            logger.info(f"FETCH_FEED | mode=generic | session={session_id}")
-            results, next_offset = hybrid_searcher.qdrant_client.scroll(
-                collection_name="products",
-                limit=limit,
-                offset=offset,
-                with_payload=True,
-            )
+            else:
+                # GENERIC FEED (Fall back to DB scroll)
+                logger.info(f"FETCH_FEED | mode=generic | session={session_id}")
+                try:
+                    results, page, next_page_token = await product_pager.fetch(limit, page, page_token)
+                except InvalidPageToken as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+                offset = (page - 1) * limit
             
-            for i, point in enumerate(results):
-                product = point.payload
-                products.append({
-                    "id": offset + i,
-                    "category": product.get("category", "Unknown"),
-                    "rating": product.get("rating", 0),
-                    "actual_price": product.get("actual_price", 0),
-                    "discounted_price": product.get("discounted_price", 0),
-                    "image_url": product.get("image_url", "").strip('"'),
-                    "product_url": product.get("product_url", "")
-                })
-
-        # Calculate total pages
-        total_pages = (total_count + limit - 1) // limit
-
-        return JSONResponse(content={
-            "success": True,
-            "data": products,
-            "count": len(products),
-            "total_count": total_count,
-            "total_pages": total_pages,
-            "current_page": page,
-            "has_next": page < total_pages,
-            "has_prev": page > 1
-        })
-    except Exception as e:
-        logger.error(f"FEED_ERROR | mode=mixed | error={str(e)}")
-        return JSONResponse(
-            status_code=500,
-            content={
-                "success": False,
-                "error": str(e)
-            }
-        )
+                for i, point in enumerate(results):
+                    product = point.payload
+                    products.append({
+                        "id": offset + i,
+                        "category": product.get("category", "Unknown"),
+                        "rating": product.get("rating", 0),
+                        "actual_price": product.get("actual_price", 0),
+                        "discounted_price": product.get("discounted_price", 0),
+                        "image_url": product.get("image_url", "").strip('"'),
+                        "product_url": product.get("product_url", "")
+                    })
+
+            # Calculate total pages
+            total_pages = (total_count + limit - 1) // limit
+
+            return json_response({
+                "success": True,
+                "data": products,
+                "count": len(products),
+                "total_count": total_count,
+                "total_pages": total_pages,
+                "current_page": page,
+                "has_next": next_page_token is not None,
+                "has_prev": page > 1,
+                "next_page_token": next_page_token
+            }, timing)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"FEED_ERROR | mode=mixed | error={str(e)}")
+            return JSONResponse(
+                status_code=500,
+                content={
+                    "success": False,
+                    "error": str(e)
+                }
+            )
 
 
 if __name__ == "__main__":
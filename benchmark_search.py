@@ -0,0 +1,340 @@
+"""
+Recall / latency benchmark for HybridSearcher.search.
+
+Loads a synthetic (or sampled) product set into a scratch collection, then
+sweeps retrieval parameters and measures, per configuration:
+
+- recall@k against exact search with the same final stage (HNSW bypassed,
+  deep prefetch, then ColBERT rerank or the same RRF/DBSF fusion), so fusion
+  rows measure approximation error rather than a change of scoring function
+- p50 / p95 / p99 latency of HybridSearcher.search
+
+The sweep is repeated for each `text-dense` quantization mode (optionally
+with the ColBERT multivectors on disk), and a memory-vs-recall table
+estimates the vector storage each layout needs.
+
+Results go to a JSON file that generate_performance_graph.py plots:
+
+    python benchmark_search.py                          # in-process Qdrant (:memory:)
+    python benchmark_search.py --url http://localhost:6333 --products 20000
+    python benchmark_search.py --catalog walmart-products.csv --products 5000
+
+The in-process Qdrant searches exhaustively and does not quantize, so hnsw_ef
+and quantization only change recall/latency against a real server (--url).
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from App import qdrant
+from App.bootstrap import products_config
+from App.Hybrid_Search import RETRIEVAL_PROFILES, HybridSearcher, RetrievalParams
+from ingest_products import DEFAULT_FIELDS, build_points, catalog_rows, embed_batch, to_payload
+
+COLLECTION_NAME = "products_benchmark"
+
+CATEGORIES = ["headphones", "laptop", "running shoes", "backpack", "smartwatch", "coffee maker",
+              "office chair", "gaming mouse", "winter jacket", "phone case", "desk lamp", "blender"]
+ADJECTIVES = ["lightweight", "wireless", "waterproof", "premium", "budget", "compact", "ergonomic",
+              "durable", "portable", "noise cancelling", "stainless steel", "leather"]
+USES = ["travel", "the office", "students", "gaming", "outdoor sports", "the kitchen", "kids",
+        "daily commute", "home workouts", "professionals"]
+FEATURES = ["long battery life", "fast charging", "a two year warranty", "adjustable fit",
+            "a sleek design", "extra storage", "eco-friendly materials", "easy cleaning"]
+
+
+# ---------------------------------------------------------------------------
+# Data
+# ---------------------------------------------------------------------------
+
+def synthetic_products(n: int, rng: random.Random):
+    texts, payloads = [], []
+    for i in range(n):
+        category = rng.choice(CATEGORIES)
+        texts.append(
+            f"{rng.choice(ADJECTIVES)} {category} for {rng.choice(USES)} "
+            f"with {rng.choice(FEATURES)} and {rng.choice(FEATURES)}"
+        )
+        price = round(rng.uniform(5, 1500), 2)
+        payloads.append({
+            "actual_price": price,
+            "discounted_price": round(price * rng.uniform(0.6, 1.0), 2),
+            "category": category,
+            "rating": round(rng.uniform(1, 5), 1),
+            "image_url": None,
+            "product_url": f"benchmark://{i}",
+        })
+    return texts, payloads
+
+
+def sampled_products(path: str, n: int, text_column: str = None):
+    texts, payloads = [], []
+    for row, text in catalog_rows(path, text_column):
+        if len(texts) == n:
+            break
+        texts.append(text)
+        payloads.append(to_payload(row, DEFAULT_FIELDS))
+    return texts, payloads
+
+
+def synthetic_queries(n: int, rng: random.Random) -> list:
+    return [
+        rng.choice([
+            f"{rng.choice(ADJECTIVES)} {rng.choice(CATEGORIES)}",
+            f"{rng.choice(CATEGORIES)} for {rng.choice(USES)}",
+            f"{rng.choice(ADJECTIVES)} {rng.choice(CATEGORIES)} with {rng.choice(FEATURES)}",
+        ])
+        for _ in range(n)
+    ]
+
+
+def load_collection(client, texts: list, payloads: list, config: dict, batch_size: int = 64) -> dict:
+    """(Re)create the scratch collection with `config` and fill it. Returns vector counts."""
+    if client.collection_exists(COLLECTION_NAME):
+        client.delete_collection(COLLECTION_NAME)
+    client.create_collection(collection_name=COLLECTION_NAME, **config)
+    counts = {"points": len(texts), "colbert_tokens": 0, "sparse_entries": 0}
+    for start in range(0, len(texts), batch_size):
+        dense, sparse, late = embed_batch(texts[start:start + batch_size])
+        counts["colbert_tokens"] += sum(len(tokens) for tokens in late)
+        counts["sparse_entries"] += sum(len(indices) for indices, _ in sparse)
+        client.upsert(
+            collection_name=COLLECTION_NAME,
+            points=build_points(start, payloads[start:start + batch_size], dense, sparse, late),
+            wait=True,
+        )
+    return counts
+
+
+def memory_estimate(counts: dict, quantization: str, multivector_on_disk: bool) -> dict:
+    """
+    Approximate vector storage in bytes, split into RAM and disk.
+
+    float32 originals: 384 * 4 bytes per product (dense), 128 * 4 per ColBERT
+    token; int8 scalar quantization keeps 384 bytes, binary 384 / 8. Sparse
+    entries are an index and a value (8 bytes). Index structures are not counted.
+    """
+    dense = counts["points"] * 384 * 4
+    quantized = {"none": 0, "scalar": counts["points"] * 384, "binary": counts["points"] * 384 // 8}[quantization]
+    multivector = counts["colbert_tokens"] * 128 * 4
+    sparse = counts["sparse_entries"] * 8
+    ram = quantized + sparse
+    disk = 0
+    # Quantized collections keep the dense originals on disk (read for rescoring)
+    if quantization == "none":
+        ram += dense
+    else:
+        disk += dense
+    if multivector_on_disk:
+        disk += multivector
+    else:
+        ram += multivector
+    return {
+        "dense_bytes": dense,
+        "dense_quantized_bytes": quantized,
+        "multivector_bytes": multivector,
+        "sparse_bytes": sparse,
+        "ram_bytes": ram,
+        "disk_bytes": disk,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def point_ids(searcher: HybridSearcher, query: str, k: int, params: RetrievalParams) -> list:
+    kwargs = searcher._query_kwargs(searcher._embed_query(query), limit=k, params=params)
+    kwargs["with_payload"] = False
+    return [point.id for point in searcher.qdrant_client.query_points(**kwargs).points]
+
+
+def final_stage(params: RetrievalParams) -> str:
+    return params.fusion or "colbert"
+
+
+def ground_truth(searcher: HybridSearcher, queries: list, k: int, depth: int, stages: list) -> dict:
+    """Exact top-k ids per final stage ("colbert", "rrf", "dbsf") and query."""
+    truth = {}
+    for stage in stages:
+        params = RetrievalParams(prefetch_limit=depth, fusion=None if stage == "colbert" else stage, exact=True)
+        truth[stage] = {q: point_ids(searcher, q, k, params) for q in queries}
+    return truth
+
+
+def recall_at_k(found: list, truth: list) -> float:
+    if not truth:
+        return 1.0
+    return len(set(found) & set(truth)) / len(truth)
+
+
+def measure(searcher: HybridSearcher, queries: list, truth: dict, k: int, params: RetrievalParams, repeats: int) -> dict:
+    # Scored against the exact ranking of the same final stage
+    stage_truth = truth[final_stage(params)]
+    recalls = [recall_at_k(point_ids(searcher, q, k, params), stage_truth[q]) for q in queries]
+    latencies = []
+    for _ in range(repeats):
+        for q in queries:
+            started = time.perf_counter()
+            searcher.search(q, limit=k, params=params)
+            latencies.append((time.perf_counter() - started) * 1000)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "fusion": final_stage(params),
+        "prefetch_limit": params.prefetch_limit,
+        "oversampling": params.oversampling,
+        "hnsw_ef": params.hnsw_ef,
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(np.mean(latencies)), 3),
+    }
+
+
+def parse_list(value: str, cast=int) -> list:
+    return [None if v.strip().lower() == "none" else cast(v) for v in value.split(",")]
+
+
+def log_result(label: str, result: dict, k: int):
+    print(f"{label} | recall@{k}={result['recall_at_k']:.3f} | "
+          f"p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms p99={result['p99_ms']:.1f}ms")
+
+
+def sweep(searcher: HybridSearcher, queries: list, truth: dict, args, hnsw_efs: list) -> list:
+    results = []
+    for fusion in args.fusion.split(","):
+        for prefetch_limit in parse_list(args.prefetch_limits):
+            for hnsw_ef in hnsw_efs:
+                params = RetrievalParams(
+                    prefetch_limit=prefetch_limit,
+                    fusion=None if fusion == "colbert" else fusion,
+                    hnsw_ef=hnsw_ef,
+                )
+                result = measure(searcher, queries, truth, args.k, params, args.repeats)
+                results.append(result)
+                log_result(f"{result['fusion']:>8} prefetch={prefetch_limit} hnsw_ef={hnsw_ef}", result, args.k)
+
+    # The named profiles endpoints select (fast / balanced / deep)
+    for name, params in RETRIEVAL_PROFILES.items():
+        result = measure(searcher, queries, truth, args.k, params, args.repeats)
+        result["profile"] = name
+        results.append(result)
+        log_result(f"profile {name:>8}", result, args.k)
+    return results
+
+
+def run(args) -> dict:
+    load_dotenv()
+    rng = random.Random(args.seed)
+    if args.url:
+        client = QdrantClient(**qdrant.client_kwargs(args.url, timeout=120))
+    else:
+        client = QdrantClient(":memory:")
+
+    if args.catalog:
+        texts, payloads = sampled_products(args.catalog, args.products, args.text_column)
+    else:
+        texts, payloads = synthetic_products(args.products, rng)
+    queries = synthetic_queries(args.queries, rng)
+
+    hnsw_efs = parse_list(args.hnsw_ef) if args.url else [None]
+    if not args.url:
+        print("In-process Qdrant searches exhaustively and does not quantize; "
+              "skipping the hnsw_ef sweep (memory estimates still apply)")
+
+    results, memory = [], {}
+    truth_depth = min(args.truth_depth, len(texts))
+    stages = list(dict.fromkeys(args.fusion.split(",") + [final_stage(p) for p in RETRIEVAL_PROFILES.values()]))
+    for quantization in args.quantization.split(","):
+        print(f"Loading {len(texts)} products into '{COLLECTION_NAME}' (quantization={quantization}, "
+              f"multivector_on_disk={args.multivector_on_disk})...")
+        started = time.perf_counter()
+        counts = load_collection(
+            client, texts, payloads, products_config(quantization, args.multivector_on_disk)
+        )
+        print(f"Loaded in {time.perf_counter() - started:.1f}s")
+        memory[quantization] = memory_estimate(counts, quantization, args.multivector_on_disk)
+
+        searcher = HybridSearcher(COLLECTION_NAME, qdrant_client=client)
+        # Warm the query embedding cache so latencies measure retrieval, not inference
+        for q in queries:
+            searcher._embed_query(q)
+        # Exact search ignores quantization, so the truth is the same for every mode
+        truth = ground_truth(searcher, queries, args.k, truth_depth, stages)
+
+        for result in sweep(searcher, queries, truth, args, hnsw_efs):
+            result["quantization"] = quantization
+            results.append(result)
+
+    if args.url:
+        client.delete_collection(COLLECTION_NAME)
+    return {
+        "config": {
+            "backend": args.url or ":memory:",
+            "products": len(texts),
+            "source": args.catalog or "synthetic",
+            "queries": len(queries),
+            "k": args.k,
+            "repeats": args.repeats,
+            "multivector_on_disk": args.multivector_on_disk,
+            "truth": f"exact dense+sparse prefetch of {truth_depth}, then the configuration's own final stage "
+                     f"({', '.join(stages)})",
+        },
+        "memory": memory,
+        "results": results,
+    }
+
+
+def memory_report(report: dict) -> str:
+    """Memory vs. recall per quantization mode (best sweep recall and the balanced profile)."""
+    k = report["config"]["k"]
+    lines = [f"{'quantization':<13}{'RAM MB':>9}{'disk MB':>9}{'best recall@' + str(k):>17}{'balanced recall':>17}"]
+    for quantization, memory in report["memory"].items():
+        rows = [r for r in report["results"] if r["quantization"] == quantization]
+        best = max(r["recall_at_k"] for r in rows)
+        balanced = next((r["recall_at_k"] for r in rows if r.get("profile") == "balanced"), float("nan"))
+        lines.append(f"{quantization:<13}{memory['ram_bytes'] / 2**20:>9.1f}{memory['disk_bytes'] / 2**20:>9.1f}"
+                     f"{best:>17.3f}{balanced:>17.3f}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Recall/latency sweep for HybridSearcher.search")
+    parser.add_argument("--url", help="Qdrant server URL (default: in-process :memory:)")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--catalog", help="Sample products from a CSV/JSONL catalog instead of generating them")
+    parser.add_argument("--text-column", default=None,
+                        help="Catalog column to embed (default: the Walmart product/category/description composite)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--hnsw-ef", default="16,32,64,128", help="Comma-separated; 'none' = collection default")
+    parser.add_argument("--prefetch-limits", default="10,20,50,100")
+    parser.add_argument("--fusion", default="colbert,rrf,dbsf", help="colbert = ColBERT rerank")
+    parser.add_argument("--quantization", default="none,scalar,binary",
+                        help="Comma-separated text-dense quantization modes to compare")
+    parser.add_argument("--multivector-on-disk", action="store_true",
+                        help="Store the ColBERT multivectors on disk")
+    parser.add_argument("--truth-depth", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = run(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(memory_report(report))
+    print(f"Results written to: {args.output}")
@@ -1,73 +1,34 @@
+import asyncio
 import os
+import sys
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient, models
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from App import qdrant
+from App.bootstrap import PRODUCTS, ensure_collection
 
 def create_product_index():
+    """Create the payload indexes of the products collection that are missing."""
     # Load environment variables
     load_dotenv()
 
-    # Initialize Qdrant Client
-    qdrant_url = os.getenv("QDRANT_URL")
-    qdrant_api_key = os.getenv("QDRANT_API_KEY")
-
-    if not qdrant_url or not qdrant_api_key:
-        print("Error: QDRANT_URL and QDRANT_API_KEY must be set in .env file")
-        return
-
-    client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
-
-    collection_name = "products"
+    qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
+    print(f"Connecting to Qdrant: {qdrant_url}")
 
-    print(f"Connecting to Qdrant Cloud: {qdrant_url}")
-
-    # Create Index for discounted_price (Float)
-    print("Creating index for 'discounted_price'...")
-    try:
-        client.create_payload_index(
-            collection_name=collection_name,
-            field_name="discounted_price",
-            field_schema=models.PayloadSchemaType.FLOAT,
-        )
-        print("Successfully created index for 'discounted_price'")
-    except Exception as e:
-        print(f"Failed to create index (might already exist): {e}")
-
-    # Create Index for actual_price (Float)
-    print("Creating index for 'actual_price'...")
-    try:
-        client.create_payload_index(
-            collection_name=collection_name,
-            field_name="actual_price",
-            field_schema=models.PayloadSchemaType.FLOAT,
-        )
-        print("Successfully created index for 'actual_price'")
-    except Exception as e:
-        print(f"Failed to create index (might already exist): {e}")
-
-    # Create Index for rating (Float)
-    print("Creating index for 'rating'...")
-    try:
-        client.create_payload_index(
-            collection_name=collection_name,
-            field_name="rating",
-            field_schema=models.PayloadSchemaType.FLOAT,
-        )
-        print("Successfully created index for 'rating'")
-    except Exception as e:
-        print(f"Failed to create index (might already exist): {e}")
-
-    # Create Index for category (Keyword)
-    print("Creating index for 'category'...")
-    try:
-        client.create_payload_index(
-            collection_name=collection_name,
-            field_name="category",
-            field_schema=models.PayloadSchemaType.KEYWORD,
-        )
-        print("Successfully created index for 'category'")
-    except Exception as e:
-        print(f"Failed to create index (might already exist): {e}")
+    async def run():
+        client = qdrant.get_async_client(qdrant_url)
+        try:
+            # The collection itself is created by ingest_products.py
+            return await ensure_collection(client, PRODUCTS, create=False)
+        finally:
+            await qdrant.close_async_clients()
 
+    status = asyncio.run(run())
+    if not status["exists"]:
+        print(f"Collection '{PRODUCTS.name}' does not exist yet. Load it with ingest_products.py first.")
+        return
+    created = status["indexes_created"]
+    print(f"Created indexes: {', '.join(created)}" if created else "All indexes already exist")
     print("Index creation complete!")
 
 if __name__ == "__main__":
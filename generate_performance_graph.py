@@ -1,33 +1,84 @@
+import argparse
+import json
+import sys
+
 import matplotlib.pyplot as plt
-import numpy as np
-
-# Representative data points for Qdrant HNSW performance
-# These show the trade-off: small latency increase = huge recall gain, then plateaus
-latency_ms = [5, 10, 15, 20, 30, 40, 50]
-recall_score = [0.82, 0.94, 0.97, 0.985, 0.992, 0.995, 0.998]
-
-plt.figure(figsize=(10, 6))
-plt.plot(latency_ms, recall_score, marker='o', linestyle='-', color='#2A6FDB', linewidth=3, markersize=8, label='Qdrant HNSW Index')
-
-# Styling to look "Professional/High-Tech" for presentation
-plt.title('Recall@10 vs. Latency (ms)', fontsize=16, fontweight='bold', pad=20)
-plt.xlabel('Latency (milliseconds)', fontsize=12)
-plt.ylabel('Recall (Accuracy)', fontsize=12)
-plt.grid(True, linestyle='--', alpha=0.7)
-plt.ylim(0.8, 1.01)
-
-# Annotate the "Sweet Spot"
-plt.annotate('Target Operating Point\n(>99% Recall @ <30ms)', 
-             xy=(30, 0.992), 
-             xytext=(35, 0.90),
-             arrowprops=dict(facecolor='black', shrink=0.05),
-             fontsize=11,
-             bbox=dict(boxstyle="round,pad=0.3", fc="white", ec="black", alpha=0.8))
-
-plt.legend(loc='lower right')
-plt.tight_layout()
-
-# Save the plot
-output_path = 'recall_latency_graph.png'
-plt.savefig(output_path, dpi=300)
-print(f"Graph generated at: {output_path}")
+
+# Plots the measurements written by benchmark_search.py: one line per fusion
+# strategy, each point a (prefetch limit, hnsw_ef) configuration.
+
+COLORS = {"colbert": '#2A6FDB', "rrf": '#E07A1F', "dbsf": '#2CA58D'}
+# One line style per quantization mode
+LINESTYLES = ['-', '--', ':', '-.']
+
+
+def operating_point(results, tolerance=0.01):
+    """Cheapest configuration (by p95) within `tolerance` of the best recall."""
+    best_recall = max(r["recall_at_k"] for r in results)
+    candidates = [r for r in results if r["recall_at_k"] >= best_recall - tolerance]
+    return min(candidates, key=lambda r: r["p95_ms"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plot recall vs. latency from benchmark results")
+    parser.add_argument("results", nargs="?", default="benchmark_results.json")
+    parser.add_argument("--output", default="recall_latency_graph.png")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.results) as f:
+            report = json.load(f)
+    except FileNotFoundError:
+        print(f"Error: {args.results} not found. Run benchmark_search.py first.")
+        sys.exit(1)
+
+    config = report["config"]
+    # Named-profile rows repeat sweep configurations; plot the sweep only
+    results = [r for r in report["results"] if "profile" not in r]
+    k = config["k"]
+
+    plt.figure(figsize=(10, 6))
+    quantizations = list(dict.fromkeys(r.get("quantization", "none") for r in results))
+    for quantization, linestyle in zip(quantizations, LINESTYLES):
+        for fusion in dict.fromkeys(r["fusion"] for r in results):
+            points = sorted(
+                (r for r in results if r["fusion"] == fusion and r.get("quantization", "none") == quantization),
+                key=lambda r: r["p95_ms"]
+            )
+            label = 'ColBERT rerank' if fusion == "colbert" else f'{fusion.upper()} fusion'
+            if len(quantizations) > 1:
+                label += f' ({quantization} quantization)'
+            plt.plot(
+                [r["p95_ms"] for r in points], [r["recall_at_k"] for r in points],
+                marker='o', linestyle=linestyle, color=COLORS.get(fusion), linewidth=3, markersize=8,
+                label=label
+            )
+
+    # Styling to look "Professional/High-Tech" for presentation
+    plt.title(f'Recall@{k} vs. p95 Latency (ms)', fontsize=16, fontweight='bold', pad=20)
+    plt.xlabel('p95 latency of HybridSearcher.search (milliseconds)', fontsize=12)
+    plt.ylabel(f'Recall@{k} vs. exact search', fontsize=12)
+    plt.grid(True, linestyle='--', alpha=0.7)
+
+    # Annotate the operating point picked from the measurements
+    best = operating_point(results)
+    plt.annotate(f'Operating Point\n{best["fusion"]}, prefetch={best["prefetch_limit"]}, '
+                 f'hnsw_ef={best["hnsw_ef"]}, quantization={best.get("quantization", "none")}\n({best["recall_at_k"]:.1%} recall @ {best["p95_ms"]:.1f}ms p95)',
+                 xy=(best["p95_ms"], best["recall_at_k"]),
+                 xytext=(0.45, 0.2), textcoords='axes fraction',
+                 arrowprops=dict(facecolor='black', shrink=0.05),
+                 fontsize=11,
+                 bbox=dict(boxstyle="round,pad=0.3", fc="white", ec="black", alpha=0.8))
+
+    plt.figtext(0.01, 0.01, f'{config["products"]} products ({config["source"]}), '
+                f'{config["queries"]} queries, backend {config["backend"]}', fontsize=8, alpha=0.7)
+    plt.legend(loc='lower right')
+    plt.tight_layout()
+
+    # Save the plot
+    plt.savefig(args.output, dpi=300)
+    print(f"Graph generated at: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
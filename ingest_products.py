@@ -0,0 +1,376 @@
+"""
+Bulk-load a product catalog into the Qdrant `products` collection.
+
+Streams a CSV or JSONL catalog, embeds it in batches with the three search
+models (MiniLM dense, BM25 sparse, ColBERT late interaction) in a process
+pool, and upserts the batches concurrently. Progress is checkpointed after
+every batch, so an interrupted run picks up where it stopped:
+
+    python ingest_products.py walmart-products.csv --batch-size 128 --workers 2
+
+Columns default to the Walmart dataset layout used in App/datasets_walmart.ipynb:
+the embedded text is the notebook's "product : ... category : ... details : ..."
+composite, rows without a description are skipped and a missing initial_price
+falls back to final_price. Other catalogs can name the column to embed and remap
+payload fields, e.g. `--text-column description --field category=category`.
+Point ids are numbers of the rows that are kept, so re-running a batch overwrites it.
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from dataclasses import replace
+import json
+import os
+import re
+import sys
+import time
+
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient, models
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from App import embeddings, qdrant
+from App.bootstrap import PRODUCTS, QUANTIZATION_MODES, ensure_collection, products_config
+
+COLLECTION_NAME = PRODUCTS.name
+
+# payload field -> catalog column (Walmart layout)
+DEFAULT_FIELDS = {
+    "actual_price": "initial_price",
+    "discounted_price": "final_price",
+    "category": "category_name",
+    "rating": "rating",
+    "image_url": "main_image",
+    "product_url": "url",
+}
+# Embedded text of a Walmart row, as built in App/datasets_walmart.ipynb
+WALMART_TEXT = "product : {product_name} category : {category_name} details : {description}"
+WALMART_TEXT_COLUMNS = ("product_name", "category_name", "description")
+PRICE_FIELDS = {"actual_price", "discounted_price"}
+FLOAT_FIELDS = {"rating"}
+
+
+def clean_price(price_str):
+    if price_str is None:
+        return None
+    cleaned = re.sub(r"[^\d.,]", "", str(price_str))
+    if "," in cleaned and "." in cleaned:
+        cleaned = cleaned.replace(",", "")  # 1,299.00
+    else:
+        cleaned = cleaned.replace(",", ".")  # 12,99
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def read_rows(path: str):
+    """Yield catalog rows as dicts, one at a time."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def row_text(row: dict, text_column: str = None) -> str:
+    """Text embedded for a row; empty when there is nothing to embed."""
+    if text_column is not None:
+        return str(row.get(text_column) or "").strip()
+    if not str(row.get("description") or "").strip():
+        return ""
+    return WALMART_TEXT.format(**{column: row.get(column) or "" for column in WALMART_TEXT_COLUMNS})
+
+
+def catalog_rows(path: str, text_column: str = None):
+    """
+    Yield (row, text) for the catalog rows with text to embed.
+
+    Fails on the first row if the text column(s) are missing, and at the end
+    if no row had any text, instead of indexing empty documents.
+    """
+    required = (text_column,) if text_column is not None else WALMART_TEXT_COLUMNS
+    kept = 0
+    for row_number, row in enumerate(read_rows(path)):
+        if row_number == 0:
+            missing = [column for column in required if column not in row]
+            if missing:
+                raise ValueError(f"{path} has no column(s) {', '.join(missing)}; choose one with --text-column")
+        text = row_text(row, text_column)
+        if text:
+            kept += 1
+            yield row, text
+    if not kept:
+        raise ValueError(f"No row of {path} has text in {', '.join(required)}")
+
+
+def to_payload(row: dict, fields: dict) -> dict:
+    payload = {}
+    for field, column in fields.items():
+        value = row.get(column)
+        if field in PRICE_FIELDS:
+            value = clean_price(value)
+        elif field in FLOAT_FIELDS:
+            value = to_float(value)
+        payload[field] = value
+    if payload.get("actual_price") is None and "discounted_price" in payload:
+        # Same fallback as the notebook's fillna(final_price)
+        payload["actual_price"] = payload["discounted_price"]
+    return payload
+
+
+# ---------------------------------------------------------------------------
+# Embedding (runs in worker processes)
+# ---------------------------------------------------------------------------
+
+def embed_batch(texts: list):
+    """Embed document texts with all three models. Models load once per worker."""
+    dense = list(embeddings.get_model(embeddings.DENSE_MODEL).embed(texts))
+    sparse = [
+        (vector.indices, vector.values)
+        for vector in embeddings.get_model(embeddings.SPARSE_MODEL).embed(texts)
+    ]
+    late = list(embeddings.get_model(embeddings.LATE_INTERACTION_MODEL).embed(texts))
+    return dense, sparse, late
+
+
+# ---------------------------------------------------------------------------
+# Checkpoint and stats
+# ---------------------------------------------------------------------------
+
+class Checkpoint:
+    """
+    Number of leading catalog rows known to be stored.
+
+    Batches finish out of order, so the watermark only moves over a
+    contiguous run of completed batches.
+    """
+
+    def __init__(self, path: str, source: str, rows_done: int = 0):
+        self.path = path
+        self.source = source
+        self.rows_done = rows_done
+        self._completed = {}
+
+    @classmethod
+    def load(cls, path: str, source: str, restart: bool = False) -> "Checkpoint":
+        source = os.path.abspath(source)
+        if not restart and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get("source") == source:
+                return cls(path, source, state.get("rows_done", 0))
+            print(f"Checkpoint {path} is for {state.get('source')}, starting over")
+        return cls(path, source)
+
+    def complete(self, start: int, count: int):
+        self._completed[start] = count
+        advanced = False
+        while self.rows_done in self._completed:
+            self.rows_done += self._completed.pop(self.rows_done)
+            advanced = True
+        if advanced:
+            self._save()
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"source": self.source, "rows_done": self.rows_done}, f)
+        os.replace(tmp, self.path)
+
+
+class StageStats:
+    """
+    Rows and busy seconds per pipeline stage.
+
+    Stage rates are per worker (embedding process / upsert slot); the overall
+    rate is what the whole run achieved on the wall clock.
+    """
+
+    STAGES = ("read", "embed", "upsert")
+
+    def __init__(self):
+        self.rows = {stage: 0 for stage in self.STAGES}
+        self.seconds = {stage: 0.0 for stage in self.STAGES}
+        self.started = time.perf_counter()
+
+    def add(self, stage: str, rows: int, seconds: float):
+        self.rows[stage] += rows
+        self.seconds[stage] += seconds
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        parts = [f"stored={self.rows['upsert']} rows in {elapsed:.1f}s "
+                 f"({self.rows['upsert'] / elapsed if elapsed else 0:.1f} rows/s overall)"]
+        for stage in self.STAGES:
+            busy = self.seconds[stage]
+            rate = self.rows[stage] / busy if busy else 0
+            parts.append(f"{stage}={rate:.1f} rows/s")
+        return " | ".join(parts)
+
+
+# ---------------------------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------------------------
+
+def read_batches(path: str, batch_size: int, skip: int, text_column: str, fields: dict, stats: StageStats):
+    """Yield (first_row_number, texts, payloads) batches, skipping `skip` rows."""
+    texts, payloads, start = [], [], skip
+    t0 = time.perf_counter()
+    for row_number, (row, text) in enumerate(catalog_rows(path, text_column)):
+        if row_number < skip:
+            continue
+        texts.append(text)
+        payloads.append(to_payload(row, fields))
+        if len(texts) == batch_size:
+            stats.add("read", len(texts), time.perf_counter() - t0)
+            yield start, texts, payloads
+            texts, payloads, start = [], [], row_number + 1
+            t0 = time.perf_counter()
+    if texts:
+        stats.add("read", len(texts), time.perf_counter() - t0)
+        yield start, texts, payloads
+
+
+def build_points(start: int, payloads: list, dense, sparse, late) -> list:
+    return [
+        models.PointStruct(
+            id=start + i,
+            vector={
+                "text-dense": dense[i].tolist(),
+                "text-sparse": models.SparseVector(
+                    indices=sparse[i][0].tolist(),
+                    values=sparse[i][1].tolist(),
+                ),
+                "text-late-interaction": late[i].tolist(),
+            },
+            payload=payloads[i],
+        )
+        for i in range(len(payloads))
+    ]
+
+
+async def process_batch(client, pool, upsert_slots, checkpoint, stats, start, texts, payloads, retries=3):
+    loop = asyncio.get_running_loop()
+    t0 = time.perf_counter()
+    dense, sparse, late = await loop.run_in_executor(pool, embed_batch, texts)
+    stats.add("embed", len(texts), time.perf_counter() - t0)
+
+    points = build_points(start, payloads, dense, sparse, late)
+    async with upsert_slots:
+        for attempt in range(retries):
+            try:
+                t0 = time.perf_counter()
+                await client.upsert(collection_name=COLLECTION_NAME, points=points, wait=True)
+                stats.add("upsert", len(points), time.perf_counter() - t0)
+                break
+            except Exception as e:
+                if attempt == retries - 1:
+                    raise
+                print(f"Upsert of rows {start}-{start + len(points) - 1} failed ({e}), retrying")
+                await asyncio.sleep(2 ** attempt)
+    checkpoint.complete(start, len(points))
+
+
+async def ingest(args):
+    load_dotenv()
+    # Own client with a long timeout: large batched upserts are slow to acknowledge
+    client = AsyncQdrantClient(**qdrant.client_kwargs(timeout=120))
+    # Creates the collection and payload indexes if this is the first load
+    spec = replace(PRODUCTS, config=products_config(args.quantization, args.multivector_on_disk))
+    status = await ensure_collection(client, spec)
+    if status["created"]:
+        print(f"Created collection '{COLLECTION_NAME}' (quantization={args.quantization}, "
+              f"multivector_on_disk={args.multivector_on_disk})")
+    else:
+        print(f"Collection '{COLLECTION_NAME}' exists; storage options only apply when it is created")
+
+    fields = dict(DEFAULT_FIELDS)
+    for mapping in args.field or []:
+        field, column = mapping.split("=", 1)
+        fields[field] = column
+
+    checkpoint = Checkpoint.load(args.checkpoint, args.source, restart=args.restart)
+    if checkpoint.rows_done:
+        print(f"Resuming after {checkpoint.rows_done} rows")
+
+    stats = StageStats()
+    upsert_slots = asyncio.Semaphore(args.upsert_concurrency)
+    # Bound the batches held in memory (embedding queue + upserts in flight)
+    in_flight = asyncio.Semaphore(args.workers * 2 + args.upsert_concurrency)
+    tasks = set()
+    errors = []
+    last_report = time.perf_counter()
+
+    def on_done(task):
+        in_flight.release()
+        tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            errors.append(task.exception())
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            for start, texts, payloads in read_batches(
+                args.source, args.batch_size, checkpoint.rows_done, args.text_column, fields, stats
+            ):
+                await in_flight.acquire()
+                if errors:
+                    break
+                task = asyncio.create_task(
+                    process_batch(client, pool, upsert_slots, checkpoint, stats, start, texts, payloads)
+                )
+                tasks.add(task)
+                task.add_done_callback(on_done)
+
+                if time.perf_counter() - last_report > args.report_every:
+                    print(stats.report())
+                    last_report = time.perf_counter()
+            # Let batches already in flight land so the checkpoint covers them
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if errors:
+            raise errors[0]
+    finally:
+        await client.close()
+        print(stats.report())
+        print(f"Checkpoint: {checkpoint.rows_done} rows stored ({args.checkpoint})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a product catalog into Qdrant")
+    parser.add_argument("source", help="CSV or JSONL (.jsonl/.ndjson) catalog")
+    parser.add_argument("--text-column", default=None,
+                        help="Column embedded for search (default: the Walmart product/category/description composite)")
+    parser.add_argument("--field", action="append", metavar="PAYLOAD=COLUMN",
+                        help="Override a payload field's source column (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2, help="Embedding processes")
+    parser.add_argument("--upsert-concurrency", type=int, default=4)
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+    parser.add_argument("--quantization", choices=QUANTIZATION_MODES,
+                        default=os.getenv("PRODUCTS_QUANTIZATION", "none"),
+                        help="text-dense quantization for a new collection")
+    parser.add_argument("--multivector-on-disk", action="store_true",
+                        default=os.getenv("PRODUCTS_MULTIVECTOR_ON_DISK", "0") == "1",
+                        help="Keep ColBERT multivectors on disk in a new collection")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(ingest(parse_args()))